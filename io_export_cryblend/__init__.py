@@ -57,9 +57,11 @@ if "bpy" in locals():
     imp.reload(exceptions)
     imp.reload(utils)
     imp.reload(desc)
+    imp.reload(animation)
 else:
     import bpy
     from io_export_cryblend import add, export, exceptions, utils, desc
+    from io_export_cryblend import animation
 
 from bpy.props import BoolProperty, EnumProperty, FloatVectorProperty, \
     FloatProperty, IntProperty, StringProperty, BoolVectorProperty
@@ -1758,6 +1760,17 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Apply all modifiers before exporting.",
         default=True,
     )
+    modifier_mode = EnumProperty(
+        name="Modifiers",
+        items=(
+            ("EVALUATE", "Evaluate",
+             "Export temporary meshes with the modifiers applied, except"
+             " Armature, and keep the scene unchanged."),
+            ("APPLY", "Apply",
+             "Apply the modifiers to all objects, this changes the scene."),
+        ),
+        default="EVALUATE",
+    )
     do_not_merge = BoolProperty(
         name="Do Not Merge Nodes",
         description="Generally a good idea.",
@@ -1798,6 +1811,75 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Align face normals within 1 degree of each other.",
         default=False,
     )
+    weld_attributes = BoolProperty(
+        name="Weld Attributes",
+        description="Write equal normals, UVs and vertex colors only once"
+                    " and share them between corners.",
+        default=True,
+    )
+    weld_tolerance = FloatProperty(
+        name="Weld Tolerance",
+        description="Normals, UVs and vertex colors closer than this are"
+                    " written once. 0 only welds exactly equal values.",
+        default=0.0,
+        min=0.0,
+        max=0.01,
+        precision=5,
+    )
+    constant_channels = EnumProperty(
+        name="Constant Channels",
+        items=(
+            ("KEEP", "Keep",
+             "Write every key of channels which never change."),
+            ("SINGLE", "Single Key",
+             "Write channels which never change with a single key."),
+            ("SKIP", "Skip",
+             "Do not write channels which stay at the bind pose, other"
+             " constant channels get a single key."),
+        ),
+        default="KEEP",
+    )
+    reduce_keyframes = BoolProperty(
+        name="Reduce Keyframes",
+        description="Remove keys which can be rebuilt from the keys around"
+                    " them within the tolerances.",
+        default=False,
+    )
+    translation_tolerance = FloatProperty(
+        name="Translation Tolerance",
+        description="Largest location error allowed by keyframe reduction.",
+        default=animation.TRANSLATION_TOLERANCE,
+        min=0.0,
+        precision=4,
+    )
+    rotation_tolerance = FloatProperty(
+        name="Rotation Tolerance",
+        description="Largest rotation error in degrees allowed by keyframe"
+                    " reduction.",
+        default=animation.ROTATION_TOLERANCE,
+        min=0.0,
+        precision=3,
+    )
+    batch_clips = EnumProperty(
+        name="Batch Clips",
+        items=(
+            ("NONE", "Off",
+             "Export the scene frame range as one clip."),
+            ("ACTIONS", "Actions",
+             "Export every action animating bones as an i_caf."),
+            ("MARKERS", "Markers",
+             "Export the ranges between timeline markers as i_cafs."),
+            ("NLA_STRIPS", "NLA Strips",
+             "Export the actions of the armature NLA strips as i_cafs."),
+        ),
+        default="NONE",
+    )
+    clip_filter = StringProperty(
+        name="Clip Filter",
+        description="Only export clips whose names match this pattern,"
+                    " e.g. run_*.",
+        default="*",
+    )
     export_for_lumberyard = BoolProperty(
         name="Export for LumberYard",
         description="Export for LumberYard engine instead of CryEngine.",
@@ -1823,6 +1905,82 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Saves TIFF images that are generated during conversion to DDS.",
         default=False,
     )
+    dae_writer = EnumProperty(
+        name="DAE Writer",
+        items=(
+            ("AUTO", "Automatic",
+             "Stream large scenes, keep small ones in memory."),
+            ("DOM", "In Memory",
+             "Build the whole document in memory before writing it."),
+            ("STREAM", "Streaming",
+             "Write each library to the file as soon as it is exported."),
+        ),
+        default="AUTO",
+    )
+    geometry_workers = IntProperty(
+        name="Geometry Workers",
+        description="Processes formatting the geometries of large scenes,"
+                    " 0 uses one per core and 1 formats on the main thread."
+                    " Only available where Blender can fork processes,"
+                    " forking Blender is experimental.",
+        default=1,
+        min=0,
+        max=64,
+    )
+    rc_workers = IntProperty(
+        name="RC Workers",
+        description="Resource compiler jobs running at the same time, 0 runs"
+                    " one per core. The cores are shared between the jobs.",
+        default=0,
+        min=0,
+        max=64,
+    )
+    texture_workers = IntProperty(
+        name="Texture Workers",
+        description="Textures converted at the same time, 0 only limits them"
+                    " by the RC workers.",
+        default=0,
+        min=0,
+        max=64,
+    )
+    force_textures = BoolProperty(
+        name="Force Texture Conversion",
+        description="Convert every texture, even when its DDS is up to date.",
+        default=False,
+    )
+    use_export_cache = BoolProperty(
+        name="Use Export Cache",
+        description="Reuse geometries, skins, RC outputs and DDS textures"
+                    " of unchanged sources from earlier exports.",
+        default=False,
+    )
+    export_cache_dir = StringProperty(
+        name="Cache Directory",
+        description="Directory of the export cache, the system temporary"
+                    " directory is used when empty.",
+        default="",
+        subtype='DIR_PATH',
+    )
+    export_cache_size = IntProperty(
+        name="Cache Size (MB)",
+        description="Least recently used entries are removed when the cache"
+                    " grows larger.",
+        default=512,
+        min=1,
+    )
+    export_cache_age = IntProperty(
+        name="Cache Age (Days)",
+        description="Entries unused for this many days are removed.",
+        default=14,
+        min=1,
+    )
+    check_operators = BoolProperty(
+        name="Check Operator Calls",
+        description="Development check: stop the export with an error"
+                    " when it calls an operator, the export should only use"
+                    " the data API. Applying modifiers is not checked.",
+        default=False,
+    )
     run_in_profiler = BoolProperty(
         name="Profile CryBlend",
         description="Select only if you want to profile CryBlend.",
@@ -1835,6 +1993,7 @@ class Export(bpy.types.Operator, ExportHelper):
             attributes = (
                 'filepath',
                 'apply_modifiers',
+                'modifier_mode',
                 'do_not_merge',
                 'export_selected_nodes',
                 'do_materials',
@@ -1843,11 +2002,29 @@ class Export(bpy.types.Operator, ExportHelper):
                 'make_cdf',
                 'fix_weights',
                 'average_planar',
+                'weld_attributes',
+                'weld_tolerance',
+                'constant_channels',
+                'reduce_keyframes',
+                'translation_tolerance',
+                'rotation_tolerance',
+                'batch_clips',
+                'clip_filter',
                 'export_for_lumberyard',
                 'make_layer',
                 'disable_rc',
                 'save_dae',
                 'save_tiffs',
+                'dae_writer',
+                'geometry_workers',
+                'rc_workers',
+                'texture_workers',
+                'force_textures',
+                'use_export_cache',
+                'export_cache_dir',
+                'export_cache_size',
+                'export_cache_age',
+                'check_operators',
                 'run_in_profiler'
             )
 
@@ -1866,10 +2043,15 @@ class Export(bpy.types.Operator, ExportHelper):
 
             if self.run_in_profiler:
                 import cProfile
-                cProfile.runctx('export.save(config)', {},
-                                {'export': export, 'config': config})
+                profiled = {'export': export, 'config': config}
+                cProfile.runctx('errors = export.save(config)', {},
+                                profiled)
+                errors = profiled['errors']
             else:
-                export.save(config)
+                errors = export.save(config)
+
+            for message in errors:
+                self.report({'ERROR'}, message)
 
             self.filepath = '//'
 
@@ -1898,6 +2080,7 @@ class Export(bpy.types.Operator, ExportHelper):
         box = col.box()
         box.label("General", icon="WORLD")
         box.prop(self, "apply_modifiers")
+        box.prop(self, "modifier_mode")
         box.prop(self, "do_not_merge")
         box.prop(self, "export_selected_nodes")
 
@@ -1905,6 +2088,7 @@ class Export(bpy.types.Operator, ExportHelper):
         box.label("Material & Texture", icon="TEXTURE")
         box.prop(self, "do_materials")
         box.prop(self, "do_textures")
+        box.prop(self, "force_textures")
 
         box = col.box()
         box.label("Character", icon="ARMATURE_DATA")
@@ -1915,6 +2099,17 @@ class Export(bpy.types.Operator, ExportHelper):
         box.label("Corrective", icon="BRUSH_DATA")
         box.prop(self, "fix_weights")
         box.prop(self, "average_planar")
+        box.prop(self, "weld_attributes")
+        box.prop(self, "weld_tolerance")
+
+        box = col.box()
+        box.label("Animation", icon="ACTION")
+        box.prop(self, "constant_channels")
+        box.prop(self, "reduce_keyframes")
+        box.prop(self, "translation_tolerance")
+        box.prop(self, "rotation_tolerance")
+        box.prop(self, "batch_clips")
+        box.prop(self, "clip_filter")
 
         box = col.box()
         box.label("LumberYard", icon="GAME")
@@ -1929,6 +2124,15 @@ class Export(bpy.types.Operator, ExportHelper):
         box.prop(self, "disable_rc")
         box.prop(self, "save_dae")
         box.prop(self, "save_tiffs")
+        box.prop(self, "dae_writer")
+        box.prop(self, "geometry_workers")
+        box.prop(self, "rc_workers")
+        box.prop(self, "texture_workers")
+        box.prop(self, "use_export_cache")
+        box.prop(self, "export_cache_dir")
+        box.prop(self, "export_cache_size")
+        box.prop(self, "export_cache_age")
+        box.prop(self, "check_operators")
         box.prop(self, "run_in_profiler")
 
 
@@ -0,0 +1,269 @@
+#------------------------------------------------------------------------------
+# Name:        animation.py
+# Purpose:     Keyframe processing done before animations are written
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) CryBlend Team 2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from io_export_cryblend import buffers
+
+
+# Default tolerances of the keyframe reduction, in scene units and degrees.
+TRANSLATION_TOLERANCE = 0.001
+ROTATION_TOLERANCE = 0.1
+
+REDUCIBLE_INTERPOLATIONS = ('BEZIER', 'LINEAR')
+
+# Channels whose keys and handles all stay this close to the first value
+# are constant.
+CONSTANT_EPSILON = 1e-5
+
+# Keyframe interpolation names, indexed by their enum value.
+INTERPOLATIONS = (
+    'CONSTANT',
+    'LINEAR',
+    'BEZIER',
+    'BACK',
+    'BOUNCE',
+    'CIRC',
+    'CUBIC',
+    'ELASTIC',
+    'EXPO',
+    'QUAD',
+    'QUART',
+    'QUINT',
+    'SINE',
+)
+
+
+#------------------------------------------------------------------------------
+# Keyframe Access:
+#------------------------------------------------------------------------------
+
+def get_fcurve_index(action):
+    '''Returns a (data_path, array_index) to F-curve map of an action.'''
+    index = {}
+    for fcurve in action.fcurves:
+        index[(fcurve.data_path, fcurve.array_index)] = fcurve
+
+    return index
+
+
+def get_keyframes(fcurve):
+    '''Reads all keyframe points of a curve with bulk reads. Returns
+    (frame, value, interpolation, handle_left, handle_right) tuples, handles
+    are (frame, value) pairs.
+    '''
+    points = fcurve.keyframe_points
+    co = buffers.foreach_get(points, "co", 'f', 2)
+    left = buffers.foreach_get(points, "handle_left", 'f', 2)
+    right = buffers.foreach_get(points, "handle_right", 'f', 2)
+    interpolations = __get_interpolations(points)
+
+    keyframes = []
+    for index, interpolation in enumerate(interpolations):
+        x = index * 2
+        keyframes.append((co[x], co[x + 1], interpolation,
+                          (left[x], left[x + 1]), (right[x], right[x + 1])))
+
+    return keyframes
+
+
+def __get_interpolations(points):
+    try:
+        values = buffers.foreach_get(points, "interpolation", 'i')
+    except (RuntimeError, TypeError):
+        return [point.interpolation for point in points]
+
+    return [INTERPOLATIONS[value] for value in values]
+
+
+#------------------------------------------------------------------------------
+# Constant Channels:
+#------------------------------------------------------------------------------
+
+def is_constant(keyframes, epsilon=CONSTANT_EPSILON):
+    '''Checks whether a channel keeps its first value for the whole clip.
+    Bezier handles are checked too, they could move the curve between keys
+    with equal values.
+    '''
+    if not keyframes:
+        return False
+
+    first = keyframes[0][1]
+    for frame, value, interpolation, handle_left, handle_right in keyframes:
+        if abs(value - first) > epsilon:
+            return False
+        if interpolation == 'BEZIER' and (
+                abs(handle_left[1] - first) > epsilon or
+                abs(handle_right[1] - first) > epsilon):
+            return False
+
+    return True
+
+
+def get_constant_keyframes(keyframes):
+    '''Returns the first key of a constant channel with flat handles.'''
+    frame, value, interpolation, handle_left, handle_right = keyframes[0]
+    return [(frame, value, interpolation, (handle_left[0], value),
+             (handle_right[0], value))]
+
+
+#------------------------------------------------------------------------------
+# Keyframe Reduction:
+#------------------------------------------------------------------------------
+
+def reduce_keyframes(keyframes, tolerance):
+    '''Drops keys which can be rebuilt from their neighbours within the
+    tolerance. Keyframes are (frame, value, interpolation, handle_left,
+    handle_right) tuples, handles are (frame, value) pairs.
+
+    Starting from a kept key, the next segment is extended over as many
+    keys as possible while every skipped key stays within the tolerance of
+    either a straight line or a Bezier curve with the original tangents
+    at both ends. Kept keys get handles for the new segments, segments over
+    no skipped key keep their original interpolation and handles. Channels
+    with other interpolations than Bezier and linear are left unchanged.
+    '''
+    count = len(keyframes)
+    if count < 3 or any(keyframe[2] not in REDUCIBLE_INTERPOLATIONS
+                        for keyframe in keyframes):
+        return list(keyframes)
+
+    frames = [keyframe[0] for keyframe in keyframes]
+    values = [keyframe[1] for keyframe in keyframes]
+    slopes = __get_slopes(keyframes)
+
+    segments = []
+    start = 0
+    while start < count - 1:
+        end, interpolation = __find_segment_end(frames, values, slopes,
+                                                start, tolerance)
+        segments.append((start, end, interpolation))
+        start = end
+
+    return __build_keyframes(keyframes, slopes, segments)
+
+
+def __find_segment_end(frames, values, slopes, start, tolerance):
+    x0 = frames[start]
+    y0 = values[start]
+    end = start + 1
+    interpolation = None
+
+    # range of line slopes from the start key passing every skipped key
+    lowest = float("-inf")
+    highest = float("inf")
+
+    while end + 1 < len(frames):
+        dx = frames[end] - x0
+        if dx <= 0.0:
+            break
+        lowest = max(lowest, (values[end] - tolerance - y0) / dx)
+        highest = min(highest, (values[end] + tolerance - y0) / dx)
+
+        candidate = end + 1
+        dx = frames[candidate] - x0
+        if dx <= 0.0:
+            break
+
+        if lowest <= (values[candidate] - y0) / dx <= highest:
+            interpolation = 'LINEAR'
+        elif __fits_bezier(frames, values, slopes, start, candidate,
+                           tolerance):
+            interpolation = 'BEZIER'
+        else:
+            break
+
+        end = candidate
+
+    return end, interpolation
+
+
+def __fits_bezier(frames, values, slopes, start, end, tolerance):
+    x0 = frames[start]
+    dx = frames[end] - x0
+    y0 = values[start]
+    y1 = values[end]
+    m0 = slopes[start] * dx
+    m1 = slopes[end] * dx
+
+    for index in range(start + 1, end):
+        # handles a third of the way along x make the Bezier a Hermite curve
+        t = (frames[index] - x0) / dx
+        t2 = t * t
+        t3 = t2 * t
+        value = ((2 * t3 - 3 * t2 + 1) * y0 + (t3 - 2 * t2 + t) * m0 +
+                 (-2 * t3 + 3 * t2) * y1 + (t3 - t2) * m1)
+        if abs(value - values[index]) > tolerance:
+            return False
+
+    return True
+
+
+def __get_slopes(keyframes):
+    slopes = []
+    last = len(keyframes) - 1
+
+    for index, keyframe in enumerate(keyframes):
+        frame, value, interpolation, handle_left, handle_right = keyframe
+        if handle_right[0] > handle_left[0]:
+            slopes.append((handle_right[1] - handle_left[1]) /
+                          (handle_right[0] - handle_left[0]))
+            continue
+
+        previous = keyframes[max(index - 1, 0)]
+        next_ = keyframes[min(index + 1, last)]
+        if next_[0] > previous[0]:
+            slopes.append((next_[1] - previous[1]) / (next_[0] - previous[0]))
+        else:
+            slopes.append(0.0)
+
+    return slopes
+
+
+def __build_keyframes(keyframes, slopes, segments):
+    handles_left = {0: keyframes[0][3]}
+    handles_right = {}
+    interpolations = {}
+
+    for start, end, interpolation in segments:
+        if interpolation is None:
+            interpolations[start] = keyframes[start][2]
+            handles_right[start] = keyframes[start][4]
+            handles_left[end] = keyframes[end][3]
+            continue
+
+        x0, y0 = keyframes[start][0:2]
+        x1, y1 = keyframes[end][0:2]
+        dx = (x1 - x0) / 3.0
+        if interpolation == 'LINEAR':
+            dy0 = dy1 = (y1 - y0) / 3.0
+        else:
+            dy0 = slopes[start] * dx
+            dy1 = slopes[end] * dx
+
+        interpolations[start] = interpolation
+        handles_right[start] = (x0 + dx, y0 + dy0)
+        handles_left[end] = (x1 - dx, y1 - dy1)
+
+    last = segments[-1][1]
+    interpolations[last] = keyframes[last][2]
+    handles_right[last] = keyframes[last][4]
+
+    reduced = []
+    for index in sorted(interpolations):
+        frame, value = keyframes[index][0:2]
+        reduced.append((frame, value, interpolations[index],
+                        handles_left[index], handles_right[index]))
+
+    return reduced
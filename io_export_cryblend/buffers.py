@@ -0,0 +1,534 @@
+#------------------------------------------------------------------------------
+# Name:        buffers.py
+# Purpose:     Bulk extraction of mesh attributes into typed buffers
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) CryBlend Team 2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from array import array
+import math
+
+try:
+    # bundled with Blender since 2.70
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Faces whose normals are closer than this angle (radians) are averaged
+# by the "Average Planar Face Normals" export option.
+PLANAR_ANGLE_TOLERANCE = 0.052
+
+# Directions of one grid cell are compared against their neighbours in
+# blocks of this many rows, so dense cells do not allocate huge matrices.
+PLANAR_BLOCK_SIZE = 256
+
+# CryEngine skinning supports at most this many bones per vertex.
+MAX_BONE_INFLUENCES = 8
+
+
+#------------------------------------------------------------------------------
+# Bulk Access:
+#------------------------------------------------------------------------------
+
+def foreach_get(collection, attribute, typecode, size=1):
+    '''Read one attribute of every item in a bpy collection at once.'''
+    zero = 0.0 if typecode in ('f', 'd') else 0
+    buffer = array(typecode, [zero]) * (len(collection) * size)
+    if buffer:
+        collection.foreach_get(attribute, buffer)
+
+    return buffer
+
+
+def get_vertex_positions(mesh):
+    return foreach_get(mesh.vertices, "co", 'f', 3)
+
+
+def get_vertex_normals(mesh):
+    return foreach_get(mesh.vertices, "normal", 'f', 3)
+
+
+def get_tessface_normals(mesh):
+    return foreach_get(mesh.tessfaces, "normal", 'f', 3)
+
+
+def get_tessface_smooth_flags(mesh):
+    return foreach_get(mesh.tessfaces, "use_smooth", 'b')
+
+
+def get_tessface_material_indices(mesh):
+    # material_index is a short in RNA, a matching buffer is copied raw
+    return foreach_get(mesh.tessfaces, "material_index", 'h')
+
+
+def get_tessface_vertices(mesh):
+    '''Returns the corner count of every tessface and the flat list of
+    corner vertex indices. Tessfaces store four indices each, the fourth
+    one is zero for triangles.
+    '''
+    raw = foreach_get(mesh.tessfaces, "vertices_raw", 'i', 4)
+    sizes = array('i', [0]) * (len(raw) // 4)
+    corners = array('i')
+
+    for face_index in range(len(sizes)):
+        start = face_index * 4
+        if raw[start + 3] == 0:
+            sizes[face_index] = 3
+            corners.extend(raw[start:start + 3])
+        else:
+            sizes[face_index] = 4
+            corners.extend(raw[start:start + 4])
+
+    return sizes, corners
+
+
+def get_tessface_uvs(uvlayer, face_sizes):
+    '''Returns per corner UVs of a tessface UV layer.'''
+    raw = foreach_get(uvlayer.data, "uv_raw", 'f', 8)
+    if all(size == 4 for size in face_sizes):
+        return raw
+
+    uvs = array('f')
+    for face_index, size in enumerate(face_sizes):
+        start = face_index * 8
+        uvs.extend(raw[start:start + size * 2])
+
+    return uvs
+
+
+def get_vertex_group_weights(mesh):
+    '''Returns the number of vertex group entries of every vertex and the
+    flat lists of their group indices and weights.
+    '''
+    counts = array('i', [0]) * len(mesh.vertices)
+    groups = array('i')
+    weights = array('f')
+
+    for vertex_index, vertex in enumerate(mesh.vertices):
+        vertex_groups = vertex.groups
+        counts[vertex_index] = len(vertex_groups)
+        for element in vertex_groups:
+            groups.append(element.group)
+            weights.append(element.weight)
+
+    return counts, groups, weights
+
+
+#------------------------------------------------------------------------------
+# Mesh Buffers:
+#------------------------------------------------------------------------------
+
+class MeshBuffers:
+    '''Typed copies of the mesh data needed by the geometry writers.
+    Tessfaces have to be calculated before creating it.
+    '''
+
+    def __init__(self, mesh):
+        self.positions = get_vertex_positions(mesh)
+        self.vertex_normals = get_vertex_normals(mesh)
+        self.face_sizes, self.face_vertices = get_tessface_vertices(mesh)
+        self.face_normals = get_tessface_normals(mesh)
+        self.face_smooth = get_tessface_smooth_flags(mesh)
+        self.face_materials = get_tessface_material_indices(mesh)
+
+        self.uv_layers = []
+        for uvlayer in mesh.tessface_uv_textures:
+            self.uv_layers.append(get_tessface_uvs(uvlayer, self.face_sizes))
+
+    @property
+    def face_count(self):
+        return len(self.face_sizes)
+
+    def get_corner_normals(self, average_planar=False):
+        '''Returns normals in the order they are written to the DAE:
+        one per corner for smooth faces, one per face for flat faces.
+        '''
+        vertex_normals = self.vertex_normals
+        face_normals = self.face_normals
+        if average_planar:
+            face_normals = average_planar_normals(self.face_normals,
+                                                  self.face_smooth)
+            vertex_normals = array(face_normals.typecode, vertex_normals)
+        normals = array(face_normals.typecode)
+        corner = 0
+
+        for face_index, size in enumerate(self.face_sizes):
+            if self.face_smooth[face_index]:
+                for vertex in self.face_vertices[corner:corner + size]:
+                    normals.extend(vertex_normals[vertex * 3:vertex * 3 + 3])
+            else:
+                normals.extend(face_normals[face_index * 3:face_index * 3 + 3])
+            corner += size
+
+        return normals
+
+    def get_corner_normal_values(self, average_planar=False):
+        '''Returns the normal of every corner: the vertex normal on smooth
+        faces, the face normal on flat faces. Used for welding, where every
+        corner points to its own entry.
+        '''
+        vertex_normals = self.vertex_normals
+        face_normals = self.face_normals
+        if average_planar:
+            face_normals = average_planar_normals(self.face_normals,
+                                                  self.face_smooth)
+        normals = array(face_normals.typecode)
+        corner = 0
+
+        for face_index, size in enumerate(self.face_sizes):
+            if self.face_smooth[face_index]:
+                for vertex in self.face_vertices[corner:corner + size]:
+                    normals.extend(vertex_normals[vertex * 3:vertex * 3 + 3])
+            else:
+                normal = face_normals[face_index * 3:face_index * 3 + 3]
+                for repeat in range(size):
+                    normals.extend(normal)
+            corner += size
+
+        return normals
+
+    def get_polylists(self, material_count, with_colors=False,
+                      welded_indices=None):
+        '''Returns (vcount, p) index arrays for every material slot.
+        Faces are bucketed by material index in a single pass. Every corner
+        gets its vertex, normal and texcoord index, plus the texcoord index
+        again for the color input when the mesh has vertex colors.
+
+        welded_indices are per corner (normal, texcoord, color) index arrays
+        into welded sources, they replace the indices above.
+        '''
+        stride = 4 if with_colors else 3
+        face_counts = [0] * material_count
+        corner_counts = [0] * material_count
+        for face_index, material in enumerate(self.face_materials):
+            if material < material_count:
+                face_counts[material] += 1
+                corner_counts[material] += self.face_sizes[face_index]
+
+        vcounts = [array('i', [0]) * count for count in face_counts]
+        indices = [array('i', [0]) * (count * stride)
+                   for count in corner_counts]
+        face_positions = [0] * material_count
+        index_positions = [0] * material_count
+
+        corner = 0
+        normal = 0
+        for face_index, size in enumerate(self.face_sizes):
+            material = self.face_materials[face_index]
+            smooth = self.face_smooth[face_index]
+
+            if material < material_count:
+                vcounts[material][face_positions[material]] = size
+                face_positions[material] += 1
+
+                p = indices[material]
+                position = index_positions[material]
+                for texcoord in range(corner, corner + size):
+                    vertex = self.face_vertices[texcoord]
+                    p[position] = vertex
+                    if welded_indices is None:
+                        p[position + 1] = vertex if smooth else normal
+                        p[position + 2] = texcoord
+                        if with_colors:
+                            p[position + 3] = texcoord
+                    else:
+                        normals, texcoords, colors = welded_indices
+                        p[position + 1] = normals[texcoord]
+                        p[position + 2] = texcoords[texcoord]
+                        if with_colors:
+                            p[position + 3] = colors[texcoord]
+                    position += stride
+                index_positions[material] = position
+
+            corner += size
+            normal += size if smooth else 1
+
+        return list(zip(vcounts, indices))
+
+    def get_uvs(self):
+        '''Returns all UV layers appended one after another.'''
+        if len(self.uv_layers) == 1:
+            return self.uv_layers[0]
+
+        uvs = array('f')
+        for uvlayer in self.uv_layers:
+            uvs.extend(uvlayer)
+
+        return uvs
+
+
+#------------------------------------------------------------------------------
+# Attribute Welding:
+#------------------------------------------------------------------------------
+
+def weld(values, size, tolerance=0.0):
+    '''Merges equal entries of a flat array of size long tuples. Entries
+    are hashed as tuples, with a tolerance as tuples of their cell in a grid
+    with that spacing, so entries closer than the tolerance usually merge.
+    Returns the unique entries in order of their first use and the index of
+    every entry into them.
+    '''
+    typecode = values.typecode if isinstance(values, array) else 'd'
+    unique = array(typecode)
+    indices = array('i', [0]) * (len(values) // size)
+    unique_index = {}
+
+    for entry in range(len(indices)):
+        start = entry * size
+        value = tuple(values[start:start + size])
+        if tolerance:
+            key = tuple(int(round(component / tolerance))
+                        for component in value)
+        else:
+            key = value
+
+        index = unique_index.get(key)
+        if index is None:
+            index = len(unique_index)
+            unique_index[key] = index
+            unique.extend(value)
+        indices[entry] = index
+
+    return unique, indices
+
+
+#------------------------------------------------------------------------------
+# Average Planar Normals:
+#------------------------------------------------------------------------------
+
+def average_planar_normals(face_normals, face_smooth,
+                           tolerance=PLANAR_ANGLE_TOLERANCE):
+    '''Returns face normals where every flat face normal is averaged with
+    the normals of all faces within the tolerance angle. The face itself is
+    counted twice, once as the starting value and once as a match, the same
+    way the original face by face comparison did.
+
+    Identical normals are merged first and the unique directions are put
+    into a grid on the unit sphere, so only the neighbouring cells have to
+    be compared instead of every pair of faces. With NumPy the directions
+    of a cell are compared against their neighbours as one matrix product,
+    otherwise one by one.
+    '''
+    unique_index = {}
+    unique_normals = []
+    unique_counts = []
+    unique_flat = []
+    face_unique = array('i', [0]) * len(face_smooth)
+
+    for face_index in range(len(face_smooth)):
+        normal = tuple(face_normals[face_index * 3:face_index * 3 + 3])
+        index = unique_index.get(normal)
+        if index is None:
+            index = len(unique_normals)
+            unique_index[normal] = index
+            unique_normals.append(normal)
+            unique_counts.append(0)
+            unique_flat.append(False)
+        unique_counts[index] += 1
+        if not face_smooth[face_index]:
+            unique_flat[index] = True
+        face_unique[face_index] = index
+
+    # two unit vectors closer than the tolerance angle are closer than this
+    # chord, so matching directions are always in neighbouring grid cells
+    cell_size = 2.0 * math.sin(tolerance / 2.0)
+    min_cosine = math.cos(tolerance)
+    if numpy is not None:
+        averaged = __average_in_blocks(unique_normals, unique_counts,
+                                       unique_flat, cell_size, min_cosine)
+    else:
+        averaged = __average_one_by_one(unique_normals, unique_counts,
+                                        unique_flat, cell_size, min_cosine)
+
+    result = array('d', face_normals)
+    for face_index in range(len(face_smooth)):
+        if not face_smooth[face_index]:
+            index = face_unique[face_index]
+            result[face_index * 3:face_index * 3 + 3] = averaged[index]
+
+    return result
+
+
+def __average_one_by_one(unique_normals, unique_counts, unique_flat,
+                         cell_size, min_cosine):
+    directions = [__normalized(normal) for normal in unique_normals]
+    grid = {}
+    for index, direction in enumerate(directions):
+        if direction is None:
+            continue
+
+        multiplicity = unique_counts[index]
+        nx, ny, nz = unique_normals[index]
+        entry = (direction[0], direction[1], direction[2],
+                 nx * multiplicity, ny * multiplicity, nz * multiplicity,
+                 multiplicity)
+        grid.setdefault(__get_cell(direction, cell_size), []).append(entry)
+
+    averaged = [None] * len(unique_normals)
+    for index, flat in enumerate(unique_flat):
+        if flat:
+            averaged[index] = __average_unique_normal(
+                unique_normals[index], directions[index], grid, cell_size,
+                min_cosine)
+
+    return averaged
+
+
+def __average_in_blocks(unique_normals, unique_counts, unique_flat,
+                        cell_size, min_cosine):
+    normals = numpy.array(unique_normals, dtype=numpy.float64)
+    normals = normals.reshape((len(unique_normals), 3))
+    counts = numpy.array(unique_counts, dtype=numpy.float64)
+    # the sums start with the normal itself, counted once
+    totals = numpy.hstack((normals, numpy.ones((len(counts), 1))))
+
+    lengths = numpy.sqrt((normals ** 2).sum(axis=1))
+    # zero length normals have no valid angle to any other normal
+    valid = numpy.flatnonzero(lengths > 0.0)
+    directions = normals[valid] / lengths[valid, numpy.newaxis]
+    weighted = numpy.hstack((normals[valid] * counts[valid, numpy.newaxis],
+                             counts[valid, numpy.newaxis]))
+    flat = numpy.array(unique_flat, dtype=bool)[valid]
+
+    # one integer key per grid cell, neighbours are at fixed offsets
+    span = int(2.0 / cell_size) + 4
+    cells = numpy.floor(directions / cell_size).astype(numpy.int64) + span
+    width = 2 * span + 1
+    keys = (cells[:, 0] * width + cells[:, 1]) * width + cells[:, 2]
+    order = numpy.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    cell_keys, starts = numpy.unique(sorted_keys, return_index=True)
+    ends = numpy.append(starts[1:], len(order))
+    ranges = dict(zip(cell_keys.tolist(), zip(starts.tolist(),
+                                              ends.tolist())))
+    offsets = [(x * width + y) * width + z
+               for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+
+    for key, (start, end) in ranges.items():
+        rows = order[start:end]
+        rows = rows[flat[rows]]
+        if not len(rows):
+            continue
+
+        candidates = numpy.concatenate([
+            order[slice(*ranges[key + offset])]
+            for offset in offsets if key + offset in ranges])
+        candidate_directions = directions[candidates].T
+        candidate_weights = weighted[candidates]
+
+        for block in range(0, len(rows), PLANAR_BLOCK_SIZE):
+            block_rows = rows[block:block + PLANAR_BLOCK_SIZE]
+            # same as comparing the angle, acos is monotonic
+            matches = numpy.dot(directions[block_rows],
+                                candidate_directions) > min_cosine
+            totals[valid[block_rows]] += numpy.dot(
+                matches.astype(numpy.float64), candidate_weights)
+
+    averaged = totals[:, :3] / totals[:, 3:]
+    return [array('d', normal) for normal in averaged.tolist()]
+
+
+def __average_unique_normal(normal, direction, grid, cell_size, min_cosine):
+    nx, ny, nz = normal
+    count = 1
+
+    if direction is not None:
+        cx, cy, cz = __get_cell(direction, cell_size)
+        dx, dy, dz = direction
+        for x in (cx - 1, cx, cx + 1):
+            for y in (cy - 1, cy, cy + 1):
+                for z in (cz - 1, cz, cz + 1):
+                    for ox, oy, oz, sx, sy, sz, m in grid.get((x, y, z), ()):
+                        # same as comparing the angle, acos is monotonic
+                        if dx * ox + dy * oy + dz * oz > min_cosine:
+                            nx += sx
+                            ny += sy
+                            nz += sz
+                            count += m
+
+    return array('d', (nx / count, ny / count, nz / count))
+
+
+def __normalized(normal):
+    length = math.sqrt(normal[0] ** 2 + normal[1] ** 2 + normal[2] ** 2)
+    if length == 0.0:
+        # zero length normals have no valid angle to any other normal
+        return None
+
+    return (normal[0] / length, normal[1] / length, normal[2] / length)
+
+
+def __get_cell(direction, cell_size):
+    return (int(math.floor(direction[0] / cell_size)),
+            int(math.floor(direction[1] / cell_size)),
+            int(math.floor(direction[2] / cell_size)))
+
+
+#------------------------------------------------------------------------------
+# Skin Weights:
+#------------------------------------------------------------------------------
+
+def select_bone_influences(counts, groups, weights, joint_indices,
+                           limit=MAX_BONE_INFLUENCES):
+    '''Maps vertex group weights to joints and keeps the heaviest `limit`
+    influences of every vertex. Groups without a joint (joint index -1) and
+    zero weights are dropped. The kept weights of every vertex are scaled
+    to sum up to 1.
+
+    Returns the vcount array, the flat (joint, weight index) v array, the
+    weights and the number of vertices which had too many influences.
+    '''
+    vcount = array('i', [0]) * len(counts)
+    v = array('i')
+    kept_weights = array('d')
+    truncated = 0
+
+    start = 0
+    for vertex_index, count in enumerate(counts):
+        influences = []
+        for element in range(start, start + count):
+            joint = joint_indices[groups[element]]
+            weight = weights[element]
+            if weight != 0 and joint >= 0:
+                influences.append((joint, weight))
+        start += count
+
+        if len(influences) > limit:
+            truncated += 1
+            influences = __get_heaviest_influences(influences, limit)
+        influences = __normalize_influences(influences)
+
+        vcount[vertex_index] = len(influences)
+        for joint, weight in influences:
+            v.append(joint)
+            v.append(len(kept_weights))
+            kept_weights.append(weight)
+
+    return vcount, v, kept_weights, truncated
+
+
+def __get_heaviest_influences(influences, limit):
+    order = sorted(range(len(influences)),
+                   key=lambda index: (-influences[index][1],
+                                      influences[index][0]))
+    return [influences[index] for index in sorted(order[:limit])]
+
+
+def __normalize_influences(influences):
+    total = sum(weight for joint, weight in influences)
+    if total <= 0.0:
+        # vertex group weights are never negative, only vertices without
+        # influences get here
+        return influences
+
+    return [(joint, weight / total) for joint, weight in influences]
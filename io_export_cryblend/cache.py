@@ -0,0 +1,410 @@
+#------------------------------------------------------------------------------
+# Name:        cache.py
+# Purpose:     On-disk caches of exported fragments, textures and RC outputs
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) CryBlend Team 2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from io_export_cryblend.outpipe import cbPrint
+from array import array
+from functools import partial
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+
+
+# Bump when the written fragments change, so old entries are not reused.
+FORMAT_VERSION = 2
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), "cryblend_cache")
+
+MEGABYTE = 1024 * 1024
+DAY = 24 * 60 * 60
+
+# Files written by the RC which are stored in the artifact cache.
+ARTIFACT_EXTENSIONS = (".cgf", ".cga", ".chr", ".skin", ".caf", ".anm",
+                       ".mtl")
+
+# The creation time changes with every export, it is left out of the DAE
+# hash so unchanged scenes reuse their RC outputs.
+CREATED_PATTERN = re.compile(b"<created>[^<]*</created>")
+
+
+def hash_key(*parts):
+    '''Returns a hex digest of all parts. Arrays and bytes are hashed by
+    their content, everything else by its repr.
+    '''
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, array):
+            data = part.typecode.encode() + part.tobytes()
+        elif isinstance(part, bytes):
+            data = part
+        else:
+            data = repr(part).encode("utf-8")
+        # the length keeps ("ab", "c") and ("a", "bc") apart
+        digest.update(str(len(data)).encode())
+        digest.update(b":")
+        digest.update(data)
+
+    return digest.hexdigest()
+
+
+def hash_file(filepath, chunk_size=MEGABYTE):
+    '''Returns a hex digest of the content of a file or None when it can
+    not be read.
+    '''
+    digest = hashlib.sha1()
+    try:
+        with open(filepath, 'rb') as file_:
+            for chunk in iter(partial(file_.read, chunk_size), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+
+    return digest.hexdigest()
+
+
+def create_export_cache(config):
+    '''Returns the fragment cache of an export or None when it is turned
+    off.
+    '''
+    if not config.use_export_cache:
+        return None
+
+    directory = config.export_cache_dir or DEFAULT_DIRECTORY
+    return DiskCache(os.path.join(directory, "fragments"),
+                     config.export_cache_size * MEGABYTE,
+                     config.export_cache_age * DAY,
+                     extension=".xml")
+
+
+def create_artifact_cache(config):
+    '''Returns the RC artifact cache or None when the export cache is
+    turned off.
+    '''
+    if not config.use_export_cache:
+        return None
+
+    directory = config.export_cache_dir or DEFAULT_DIRECTORY
+    return DiskCache(os.path.join(directory, "artifacts"),
+                     config.export_cache_size * MEGABYTE,
+                     config.export_cache_age * DAY,
+                     extension=".zip")
+
+
+def create_texture_cache(config):
+    '''Returns the DDS manifest of the texture conversion or None when the
+    export cache is turned off.
+    '''
+    if not config.use_export_cache:
+        return None
+
+    directory = config.export_cache_dir or DEFAULT_DIRECTORY
+    return TextureCache(os.path.join(directory, "textures.json"),
+                        config.force_textures)
+
+
+class DiskCache:
+    '''Stores one file per key in a directory. Entries are touched when
+    they are used, eviction removes entries older than max_age seconds and
+    then the least recently used ones until the cache fits into max_size
+    bytes. RC worker threads share one cache, its methods hold a lock.
+    '''
+
+    def __init__(self, directory, max_size, max_age, extension=""):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            return self.__get(key)
+
+    def put(self, key, data):
+        with self.__lock:
+            self.__put(key, data)
+
+    def get_lines(self, key):
+        data = self.get(key)
+        if data is None:
+            return None
+
+        return data.decode("utf-8").split("\n")
+
+    def put_lines(self, key, lines):
+        self.put(key, "\n".join(lines).encode("utf-8"))
+
+    def evict(self):
+        with self.__lock:
+            self.__evict()
+
+    def report(self, name):
+        with self.__lock:
+            requests = self.hits + self.misses
+            hit_rate = 100.0 * self.hits / requests if requests else 0.0
+            cbPrint("{} cache: {} hits, {} misses ({:.1f}%), {} stored,"
+                    " {} evicted.".format(name, self.hits, self.misses,
+                                          hit_rate, self.stored,
+                                          self.evicted))
+
+    def __get(self, key):
+        filepath = self.__get_filepath(key)
+        try:
+            with open(filepath, 'rb') as file_:
+                data = file_.read()
+            os.utime(filepath, None)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def __put(self, key, data):
+        filepath = self.__get_filepath(key)
+        temp_filepath = "{}.{}.tmp".format(filepath, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_filepath, 'wb') as file_:
+                file_.write(data)
+            # a reader never sees a half written entry
+            os.replace(temp_filepath, filepath)
+        except OSError as error:
+            cbPrint("Could not write cache entry {!r}: {}".format(
+                filepath, error), 'warning')
+            return
+
+        self.stored += 1
+
+    def __evict(self):
+        entries = []
+        now = time.time()
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return
+
+        for filename in filenames:
+            filepath = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                self.__remove(filepath)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, filepath))
+
+        total_size = sum(size for mtime, size, filepath in entries)
+        for mtime, size, filepath in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self.__remove(filepath)
+            total_size -= size
+
+    def __get_filepath(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def __remove(self, filepath):
+        try:
+            os.remove(filepath)
+        except OSError:
+            return
+        self.evicted += 1
+
+
+class TextureCache:
+    '''Remembers the DDS files built from source images, so images which
+    did not change since their last conversion are skipped. The manifest
+    maps every DDS path to the hash of its source image, the RC parameters
+    and the size and modification time of the DDS, a DDS changed by anyone
+    else is converted again. Forcing converts every image.
+    '''
+
+    def __init__(self, filepath, force=False):
+        self.filepath = filepath
+        self.force = force
+        self.up_to_date = 0
+        self.converted = 0
+        self.__entries = {}
+
+        try:
+            with open(filepath, 'r') as file_:
+                self.__entries = json.load(file_)
+        except (OSError, ValueError):
+            pass
+
+    def is_up_to_date(self, dds_path, source_hash, params):
+        entry = self.__entries.get(dds_path)
+        fresh = (not self.force and
+                 source_hash is not None and
+                 entry is not None and
+                 entry["source_hash"] == source_hash and
+                 entry["params"] == list(params) and
+                 entry["dds"] == self.__get_file_state(dds_path))
+
+        if fresh:
+            self.up_to_date += 1
+        else:
+            self.converted += 1
+
+        return fresh
+
+    def record(self, dds_path, source_hash, params):
+        dds_state = self.__get_file_state(dds_path)
+        if source_hash is None or dds_state is None:
+            self.__entries.pop(dds_path, None)
+            return
+
+        self.__entries[dds_path] = {
+            "source_hash": source_hash,
+            "params": list(params),
+            "dds": dds_state,
+        }
+
+    def save(self):
+        temp_filepath = "{}.{}.tmp".format(self.filepath, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            with open(temp_filepath, 'w') as file_:
+                json.dump(self.__entries, file_, indent=1, sort_keys=True)
+            os.replace(temp_filepath, self.filepath)
+        except OSError as error:
+            cbPrint("Could not write texture cache {!r}: {}".format(
+                self.filepath, error), 'warning')
+
+    def report(self):
+        cbPrint("Texture cache: {} up to date, {} converted{}.".format(
+            self.up_to_date, self.converted,
+            " (forced)" if self.force else ""))
+
+    def __get_file_state(self, filepath):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+
+        return [stat.st_size, stat.st_mtime]
+
+
+class RCArtifacts:
+    '''Restores the RC outputs of a DAE from the artifact cache instead of
+    running the RC, or stores them after a successful run. The key hashes
+    the DAE without its creation time, the RC executable and the RC
+    parameters. Outputs are the files next to the DAE named after one of
+    the output names, they are stored together in one ZIP entry.
+    '''
+
+    def __init__(self, artifact_cache, dae_path, rc_path, params,
+                 output_names):
+        self.artifact_cache = artifact_cache
+        self.dae_path = dae_path
+        self.rc_path = rc_path
+        self.params = list(params)
+        self.output_names = set(output_names)
+        self.directory = os.path.dirname(dae_path)
+        self.__key = None
+        self.__outputs_before = {}
+
+    def restore(self):
+        '''Writes the cached outputs next to the DAE. Returns False when
+        the RC has to run.
+        '''
+        self.__key = self.__get_key()
+        data = None
+        if self.__key is not None:
+            data = self.artifact_cache.get(self.__key)
+
+        if data is not None:
+            try:
+                with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                    archive.extractall(self.directory)
+                return True
+            except (OSError, zipfile.BadZipFile) as error:
+                cbPrint("Could not restore RC outputs of {!r}: {}".format(
+                    self.dae_path, error), 'warning')
+
+        self.__outputs_before = self.__get_outputs()
+        return False
+
+    def store(self):
+        '''Stores the outputs the RC wrote since restore() was called.'''
+        if self.__key is None:
+            return
+
+        outputs = self.__get_outputs()
+        written = sorted(filename for filename, state in outputs.items()
+                         if self.__outputs_before.get(filename) != state)
+        if not written:
+            return
+
+        buffer = io.BytesIO()
+        try:
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for filename in written:
+                    archive.write(os.path.join(self.directory, filename),
+                                  filename)
+        except OSError as error:
+            cbPrint("Could not store RC outputs of {!r}: {}".format(
+                self.dae_path, error), 'warning')
+            return
+
+        self.artifact_cache.put(self.__key, buffer.getvalue())
+        self.artifact_cache.evict()
+
+    def __get_key(self):
+        try:
+            with open(self.dae_path, 'rb') as file_:
+                dae = CREATED_PATTERN.sub(b"<created/>", file_.read())
+        except OSError:
+            return None
+
+        try:
+            rc_stat = os.stat(self.rc_path)
+            rc_version = (self.rc_path, rc_stat.st_size, rc_stat.st_mtime)
+        except OSError:
+            rc_version = self.rc_path
+
+        return hash_key("rc", FORMAT_VERSION, dae, rc_version, self.params)
+
+    def __get_outputs(self):
+        outputs = {}
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return outputs
+
+        for filename in filenames:
+            name, extension = os.path.splitext(filename)
+            if (extension.lower() not in ARTIFACT_EXTENSIONS or
+                    name not in self.output_names):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            outputs[filename] = (stat.st_size, stat.st_mtime)
+
+        return outputs
@@ -0,0 +1,188 @@
+#------------------------------------------------------------------------------
+# Name:        daewriter.py
+# Purpose:     DOM and streaming backends for writing the DAE file
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) CryBlend Team 2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from io_export_cryblend.outpipe import cbPrint
+from xml.dom.minidom import Element, Text
+import io
+import os
+
+
+INDENT = "    "
+NEWLINE = "\n"
+
+# Number of values formatted at once when an array is written to a file.
+CHUNK_SIZE = 3 * 4096
+
+# Scenes with more vertices than this are streamed by the 'AUTO' backend.
+STREAMING_VERTEX_THRESHOLD = 100000
+
+
+#------------------------------------------------------------------------------
+# Array Payloads:
+#------------------------------------------------------------------------------
+
+class ArrayText(Text):
+    '''Text node holding a number array, e.g. the content of a float_array
+    or p element. The array is only converted to text while the node is
+    written, one chunk at a time, so the full string never has to exist.
+    '''
+
+    def __init__(self, values, formatter):
+        Text.__init__(self)
+        self.values = values
+        self.formatter = formatter
+
+    def _get_data(self):
+        return self.formatter(self.values)
+
+    def _set_data(self, data):
+        raise TypeError("ArrayText content can not be replaced by a string")
+
+    data = nodeValue = property(_get_data, _set_data)
+
+    def writexml(self, writer, indent="", addindent="", newl=""):
+        writer.write(indent)
+        for start in range(0, len(self.values), CHUNK_SIZE):
+            if start:
+                writer.write(" ")
+            writer.write(self.formatter(self.values[start:start + CHUNK_SIZE]))
+        writer.write(newl)
+
+
+class RawXML(Element):
+    '''Element which was already formatted, e.g. in a worker process. Its
+    lines are written as they are, only indented to their place in the
+    document.
+    '''
+
+    def __init__(self, tag_name, lines):
+        Element.__init__(self, tag_name)
+        self.lines = lines
+
+    def writexml(self, writer, indent="", addindent="", newl=""):
+        for line in self.lines:
+            writer.write(indent)
+            writer.write(line)
+            writer.write(newl)
+
+
+def render_lines(element):
+    '''Formats an element as lines of XML for a RawXML, without indentation
+    of the element itself.
+    '''
+    buffer = io.StringIO()
+    element.writexml(buffer, "", INDENT, "\n")
+    return buffer.getvalue().splitlines()
+
+
+#------------------------------------------------------------------------------
+# Writers:
+#------------------------------------------------------------------------------
+
+def create_writer(backend, filepath, vertex_count):
+    if backend == 'AUTO':
+        if vertex_count > STREAMING_VERTEX_THRESHOLD:
+            backend = 'STREAM'
+        else:
+            backend = 'DOM'
+
+    cbPrint("Writing DAE with {!r} backend.".format(backend))
+
+    if backend == 'STREAM':
+        return StreamingWriter(filepath)
+
+    return DomWriter(filepath)
+
+
+class DomWriter:
+    '''Keeps the whole document in memory. The document is written to the
+    file by the DAE converter after the export.
+    '''
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.document = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+
+    def begin(self, document, root_element):
+        self.document = document
+
+    def flush(self, root_element):
+        pass
+
+    def close(self, root_element):
+        pass
+
+    def abort(self):
+        pass
+
+
+class StreamingWriter:
+    '''Writes every finished library straight to the file and drops it from
+    the document, so only the library being exported is kept in memory.
+    '''
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.document = None
+        self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+
+    def begin(self, document, root_element):
+        self.__file = open(self.filepath, 'w')
+        self.__file.write('<?xml version="1.0" ?>{}'.format(NEWLINE))
+        # let minidom write the start tag, so attributes match the DOM output
+        start_tag = root_element.cloneNode(False).toxml()[:-len("/>")]
+        self.__file.write("{}>{}".format(start_tag, NEWLINE))
+
+    def flush(self, root_element):
+        for element in list(root_element.childNodes):
+            element.writexml(self.__file, INDENT, INDENT, NEWLINE)
+            root_element.removeChild(element)
+            element.unlink()
+
+    def close(self, root_element):
+        try:
+            self.flush(root_element)
+            self.__file.write("</{}>{}".format(root_element.tagName, NEWLINE))
+        finally:
+            self.__file.close()
+
+    def abort(self):
+        '''Closes the file of a failed export and removes it, a truncated
+        DAE would only fail later in the RC.
+        '''
+        if self.__file is None:
+            return
+
+        self.__file.close()
+        try:
+            os.remove(self.filepath)
+        except OSError:
+            return
+        cbPrint("Removed incomplete {!r}.".format(self.filepath), 'warning')
@@ -17,11 +17,17 @@ if "bpy" in locals():
     import imp
     imp.reload(utils)
     imp.reload(exceptions)
+    imp.reload(buffers)
+    imp.reload(daewriter)
+    imp.reload(animation)
+    imp.reload(geometry)
+    imp.reload(cache)
 else:
     import bpy
-    from io_export_cryblend import utils, add, exceptions
+    from io_export_cryblend import utils, add, exceptions, buffers, daewriter
+    from io_export_cryblend import animation, geometry, cache
 
-from io_export_cryblend.rc import RCInstance
+from io_export_cryblend.rc import RCInstance, create_rc_scheduler
 from io_export_cryblend.outpipe import cbPrint
 from io_export_cryblend.utils import join
 
@@ -40,6 +46,9 @@ import time
 import xml.dom.minidom
 
 
+RC_FAILED_MESSAGE = "RC jobs failed, see the console for details."
+
+
 AXES = {
     'X': 0,
     'Y': 1,
@@ -49,45 +58,136 @@ AXES = {
 
 class CrytekDaeExporter:
 
-    def __init__(self, config):
+    def __init__(self, config, clip=None, rc_scheduler=None,
+                 shared_libraries=None):
         self.__config = config
+        self.__clip = clip
+        self.__rc_scheduler = rc_scheduler
+        # libraries of a batch export, exported once for all clips
+        self.__shared_libraries = shared_libraries
         self.__doc = Document()
         self.__materials = self.__get_materials()
+        self.__fcurve_indices = {}
+        self.__rest_transforms = {}
+        self.__time_sources = {}
+        self.__cache = cache.create_export_cache(config)
+        self.__errors = []
 
     def export(self):
-        self.__prepare_for_export()
-
+        '''Writes the DAE and adds its RC jobs. Returns the messages of the
+        errors which did not stop the export.
+        '''
+        own_scheduler = self.__rc_scheduler is None
+        if own_scheduler:
+            self.__rc_scheduler = create_rc_scheduler(self.__config)
+
+        utils.begin_scene_index()
+        try:
+            self.__run(self.__export)
+        finally:
+            utils.end_evaluated_meshes()
+            utils.end_scene_index()
+            if own_scheduler and not self.__rc_scheduler.wait():
+                self.__errors.append(RC_FAILED_MESSAGE)
+
+        return self.__errors
+
+    def export_shared_libraries(self):
+        '''Exports the libraries which are the same for every clip of a
+        batch export. Returns them as (tag name, lines of XML) pairs for
+        the shared_libraries of the clip exporters.
+        '''
         root_element = self.__doc.createElement('collada')
-        root_element.setAttribute(
-            "xmlns", "http://www.collada.org/2005/11/COLLADASchema")
-        root_element.setAttribute("version", "1.4.1")
-        self.__doc.appendChild(root_element)
-        self.__create_file_header(root_element)
+        utils.begin_scene_index()
+        try:
+            self.__run(self.__prepare_for_export)
+            self.__run(lambda: self.__export_static_libraries(root_element))
+        finally:
+            utils.end_evaluated_meshes()
+            utils.end_scene_index()
+
+        if self.__cache is not None:
+            self.__cache.evict()
+            self.__cache.report("Export")
+
+        return [(element.tagName, daewriter.render_lines(element))
+                for element in root_element.childNodes]
 
-        # Just here for future use:
-        self.__export_library_cameras(root_element)
-        self.__export_library_lights(root_element)
-        ###
+    def __run(self, function):
+        if self.__config.check_operators:
+            with utils.forbid_operators():
+                return function()
 
+        return function()
+
+    def __export_static_libraries(self, root_element):
         self.__export_library_images(root_element)
         self.__export_library_effects(root_element)
         self.__export_library_materials(root_element)
         self.__export_library_geometries(root_element)
-
-        utils.add_fakebones()
         try:
             self.__export_library_controllers(root_element)
-            self.__export_library_animation_clips_and_animations(root_element)
-            self.__export_library_visual_scenes(root_element)
         except RuntimeError:
             pass
-        finally:
-            utils.remove_fakebones()
 
-        self.__export_scene(root_element)
+    def __export(self):
+        if self.__shared_libraries is None:
+            self.__prepare_for_export()
 
-        converter = RCInstance(self.__config)
-        converter.convert_dae(self.__doc)
+        root_element = self.__doc.createElement('collada')
+        root_element.setAttribute(
+            "xmlns", "http://www.collada.org/2005/11/COLLADASchema")
+        root_element.setAttribute("version", "1.4.1")
+        self.__doc.appendChild(root_element)
+
+        with self.__create_writer() as writer:
+            writer.begin(self.__doc, root_element)
+            self.__create_file_header(root_element)
+
+            # Just here for future use:
+            self.__export_library_cameras(root_element)
+            self.__export_library_lights(root_element)
+            ###
+
+            if self.__shared_libraries is not None:
+                for tag_name, lines in self.__shared_libraries:
+                    root_element.appendChild(daewriter.RawXML(tag_name,
+                                                              lines))
+            else:
+                self.__export_library_images(root_element)
+                self.__export_library_effects(root_element)
+                self.__export_library_materials(root_element)
+                writer.flush(root_element)
+                self.__export_library_geometries(root_element)
+            writer.flush(root_element)
+
+            # clips of a batch export share a fakebone rig set up by
+            # export_clips
+            if self.__clip is None:
+                utils.add_fakebones()
+            try:
+                if self.__shared_libraries is None:
+                    self.__export_library_controllers(root_element)
+                    writer.flush(root_element)
+                self.__export_library_animation_clips_and_animations(
+                    root_element)
+                writer.flush(root_element)
+                self.__export_library_visual_scenes(root_element)
+            except RuntimeError:
+                pass
+            finally:
+                if self.__clip is None:
+                    utils.remove_fakebones()
+
+            self.__export_scene(root_element)
+            writer.close(root_element)
+
+        if self.__cache is not None:
+            self.__cache.evict()
+            self.__cache.report("Export")
+
+        converter = RCInstance(self.__config, self.__rc_scheduler)
+        converter.convert_dae(writer.document)
 
         write_scripts(self.__config)
 
@@ -127,15 +227,32 @@ class CrytekDaeExporter:
 
         return materials
 
+    def __create_writer(self):
+        filepath = bpy.path.ensure_ext(self.__config.filepath, ".dae")
+        vertex_count = 0
+        for object_ in utils.get_type("geometry"):
+            vertex_count += len(utils.get_mesh(object_).vertices)
+
+        return daewriter.create_writer(self.__config.dae_writer, filepath,
+                                       vertex_count)
+
     def __prepare_for_export(self):
         utils.clean_file()
 
-        if self.__config.apply_modifiers:
-            utils.apply_modifiers()
-
+        # the evaluated meshes are copies, weights are fixed on the
+        # originals before they are taken
         if self.__config.fix_weights:
             utils.fix_weights()
 
+        if self.__config.apply_modifiers:
+            if self.__config.modifier_mode == 'EVALUATE':
+                utils.begin_evaluated_meshes(bpy.context.scene)
+            else:
+                # applying changes the scene and only exists as operator,
+                # it is left out of the operator check
+                with utils.allow_operators():
+                    utils.apply_modifiers()
+
     def __create_file_header(self, parent_element):
         asset = self.__doc.createElement('asset')
         parent_element.appendChild(asset)
@@ -244,7 +361,7 @@ class CrytekDaeExporter:
         return list(set(images))
 
     def __convert_images_to_dds(self, images):
-        converter = RCInstance(self.__config)
+        converter = RCInstance(self.__config, self.__rc_scheduler)
         converter.convert_tif(images)
 
 #--------------------------------------------------------------
@@ -441,117 +558,71 @@ class CrytekDaeExporter:
     def __export_library_geometries(self, parent_element):
         libgeo = self.__doc.createElement("library_geometries")
         parent_element.appendChild(libgeo)
+
+        # bpy is only read here, the elements can be built without it
+        geometries = []
         for object_ in utils.get_type("geometry"):
-            utils.set_active(object_)
-            if object_.mode != 'OBJECT':
-                bpy.ops.object.mode_set(mode='OBJECT')
-            object_.data.update(calc_tessface=1)
-            mesh = object_.data
+            if object_.mode == 'EDIT':
+                object_.update_from_editmode()
+            mesh = utils.get_mesh(object_)
+            mesh.update(calc_tessface=1)
             object_.name = object_.name
-            geometry_node = self.__doc.createElement("geometry")
-            geometry_node.setAttribute("id", object_.name)
-            mesh_node = self.__doc.createElement("mesh")
 
             start_time = clock()
-            self.__write_positions(object_, mesh, mesh_node)
-            cbPrint('Positions took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self.__write_normals(object_, mesh, mesh_node)
-            cbPrint('Normals took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self.__write_uvs(object_, mesh, mesh_node)
-            cbPrint('UVs took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self.__write_vertex_colors(object_, mesh, mesh_node)
-            cbPrint('Vertex colors took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self.__write_vertices(object_, mesh, mesh_node)
-            cbPrint('Vertices took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self.__write_polylist(object_, mesh, mesh_node)
-            cbPrint('Polylist took {:.4f} sec.'.format(clock() - start_time))
-
-            extra = self.__create_double_sided_extra("MAYA")
-            mesh_node.appendChild(extra)
-            geometry_node.appendChild(mesh_node)
-            libgeo.appendChild(geometry_node)
+            mesh_buffers = buffers.MeshBuffers(mesh)
+            cbPrint('Buffers took {:.4f} sec.'.format(clock() - start_time))
 
-    def __write_positions(self, object_, mesh, root):
-        float_positions = []
-        for vertex in mesh.vertices:
-            float_positions.extend(vertex.co)
-
-        id_ = "{!s}-positions".format(object_.name)
-        source = utils.write_source(id_, "float", float_positions, "XYZ")
-        root.appendChild(source)
-
-    def __write_normals(self, object_, mesh, root):
-        float_normals = []
-        float_normals_count = ""
-
-        for face in mesh.tessfaces:
-            if face.use_smooth:
-                for vert in face.vertices:
-                    vertex = mesh.vertices[vert]
-                    float_normals.extend(vertex.normal)
+            if not mesh_buffers.uv_layers:
+                cbPrint("Your UV map is missing.", 'warning')
             else:
-                if self.__config.average_planar:
-                    count = 1
-                    nx = face.normal.x
-                    ny = face.normal.y
-                    nz = face.normal.z
-
-                    for planar_face in mesh.tessfaces:
-                        angle = face.normal.angle(planar_face.normal)
-                        if (-.052 < angle and angle < .052):
-                            nx += planar_face.normal.x
-                            ny += planar_face.normal.y
-                            nz += planar_face.normal.z
-                            count += 1
-
-                    float_normals.append(nx / count)
-                    float_normals.append(ny / count)
-                    float_normals.append(nz / count)
-                else:
-                    float_normals.extend(face.normal)
-
-        id_ = "{!s}-normals".format(object_.name)
-        source = utils.write_source(id_, "float", float_normals, "XYZ")
-        root.appendChild(source)
-
-    def __write_uvs(self, object_, mesh, root):
-        uvdata = object_.data.tessface_uv_textures
-        if uvdata is None:
-            cbPrint("Your UV map is missing, adding...")
-            bpy.ops.mesh.uv_texture_add()
-        else:
-            cbPrint("Found UV map.")
-
-        float_uvs = []
-        for uvindex, uvlayer in enumerate(uvdata):
-            mapslot = uvindex
-            mapname = uvlayer.name
-            uvid = "{!s}-{!s}-{!s}".format(object_.name, mapname, mapslot)
-
-            for uf in uvlayer.data:
-                for uv in uf.uv:
-                    float_uvs.extend(uv)
-
-        id_ = "{!s}-UVMap-0".format(object_.name)
-        source = utils.write_source(id_, "float", float_uvs, "ST")
-        root.appendChild(source)
-
-    def __write_vertex_colors(self, object_, mesh, root):
+                cbPrint("Found UV map.")
+
+            colors, color_params = self.__get_vertex_colors(object_, mesh)
+            materials = self.__get_materials_for_object(object_)
+
+            geometries.append(geometry.GeometryData(
+                object_.name,
+                mesh_buffers,
+                self.__config.average_planar,
+                colors,
+                color_params,
+                list(materials.values()),
+                bool(mesh.vertex_colors),
+                self.__get_weld_tolerance()))
+
+        start_time = clock()
+        for geometry_node in self.__write_geometries(geometries):
+            libgeo.appendChild(geometry_node)
+        cbPrint('Geometries took {:.4f} sec.'.format(clock() - start_time))
+
+    def __write_geometries(self, geometries):
+        workers = self.__config.geometry_workers
+        if self.__cache is None:
+            return geometry.write_geometries(geometries, workers)
+
+        # unchanged objects are spliced in from the cache
+        keys = [data.get_cache_key(self.__config.cryblend_version)
+                for data in geometries]
+        fragments = [self.__cache.get_lines(key) for key in keys]
+        missing = [data for data, lines in zip(geometries, fragments)
+                   if lines is None]
+        rendered = iter(geometry.render_geometries(missing, workers))
+
+        geometry_nodes = []
+        for key, lines in zip(keys, fragments):
+            if lines is None:
+                lines = next(rendered)
+                self.__cache.put_lines(key, lines)
+            geometry_nodes.append(daewriter.RawXML("geometry", lines))
+
+        return geometry_nodes
+
+    def __get_vertex_colors(self, object_, mesh):
         float_colors = []
         alpha_found = False
 
-        if object_.data.tessface_vertex_colors:
-            color_layers = object_.data.tessface_vertex_colors
+        if mesh.tessface_vertex_colors:
+            color_layers = mesh.tessface_vertex_colors
             for color_layer in color_layers:
                 for fi, face in enumerate(color_layer.data):
                     colors = [face.color1[:], face.color2[:], face.color3[:]]
@@ -566,106 +637,14 @@ class CrytekDaeExporter:
                         else:
                             float_colors.extend(color)
 
-        if float_colors:
-            id_ = "{!s}-colors".format(object_.name)
-            params = ("RGBA" if alpha_found else "RGB")
-            source = utils.write_source(id_, "float", float_colors, params)
-            root.appendChild(source)
-
-    def __write_vertices(self, object_, mesh, root):
-        vertices = self.__doc.createElement("vertices")
-        vertices.setAttribute("id", "{}-vertices".format(object_.name))
-        input = utils.write_input(object_.name, None, "positions", "POSITION")
-        vertices.appendChild(input)
-        root.appendChild(vertices)
-
-    def __write_polylist(self, object_, mesh, root):
-        matindex = 0
-        for material, materialname in self.__get_materials_for_object(
-                object_).items():
-            vert_data = ''
-            verts_per_poly = ''
-            poly_count = normal = texcoord = 0
-
-            for face in mesh.tessfaces:
-                if face.material_index == matindex:
-                    verts_per_poly = join(
-                        verts_per_poly, len(
-                            face.vertices), ' ')
-                    poly_count += 1
-                    for vert in face.vertices:
-                        data = self.__write_vertex_data(
-                            mesh, face, vert, normal, texcoord)
-                        vert_data = join(vert_data, data)
-                        texcoord += 1
-                else:
-                    texcoord += len(face.vertices)
-
-                if face.use_smooth:
-                    normal += len(face.vertices)
-                else:
-                    normal += 1
+        params = ("RGBA" if alpha_found else "RGB")
+        return float_colors, params
 
-            if poly_count == 0:
-                matindex += 1
-                continue
+    def __get_weld_tolerance(self):
+        if self.__config.weld_attributes:
+            return self.__config.weld_tolerance
 
-            polylist = self.__doc.createElement('polylist')
-            polylist.setAttribute('material', materialname)
-            polylist.setAttribute('count', str(poly_count))
-
-            inputs = []
-            inputs.append(
-                utils.write_input(
-                    object_.name,
-                    0,
-                    'vertices',
-                    'VERTEX'))
-            inputs.append(
-                utils.write_input(
-                    object_.name,
-                    1,
-                    'normals',
-                    'NORMAL'))
-            inputs.append(
-                utils.write_input(
-                    object_.name,
-                    2,
-                    'UVMap-0',
-                    'TEXCOORD'))
-            if mesh.vertex_colors:
-                inputs.append(
-                    utils.write_input(
-                        object_.name,
-                        3,
-                        'colors',
-                        'COLOR'))
-
-            for input in inputs:
-                polylist.appendChild(input)
-
-            vcount = self.__doc.createElement('vcount')
-            vcount_text = self.__doc.createTextNode(verts_per_poly)
-            vcount.appendChild(vcount_text)
-
-            p = self.__doc.createElement('p')
-            p_text = self.__doc.createTextNode(vert_data)
-            p.appendChild(p_text)
-
-            polylist.appendChild(vcount)
-            polylist.appendChild(p)
-            root.appendChild(polylist)
-            matindex += 1
-
-    def __write_vertex_data(self, mesh, face, vert, normal, texcoord):
-        if face.use_smooth:
-            normal = vert
-
-        if mesh.vertex_colors:
-            return "{:d} {:d} {:d} {:d} ".format(
-                vert, normal, texcoord, texcoord)
-        else:
-            return "{:d} {:d} {:d} ".format(vert, normal, texcoord)
+        return None
 
 # -------------------------------------------------------------------------
 # Library Controllers: --> Skeleton Armature and List of Bone Names
@@ -686,9 +665,27 @@ class CrytekDaeExporter:
         parent_element.appendChild(library_node)
 
     def __process_bones(self, parent_node, object_, armature):
-        mesh = object_.data
         id_ = "{!s}_{!s}".format(armature.name, object_.name)
 
+        bone_names = self.__get_bone_names(object_, armature)
+        bone_matrices = self.__get_bone_matrices(armature)
+        joint_indices = self.__get_joint_indices(object_, armature)
+        counts, groups, weights = buffers.get_vertex_group_weights(
+            utils.get_mesh(object_))
+
+        key = None
+        if self.__cache is not None:
+            key = cache.hash_key(
+                "controller", cache.FORMAT_VERSION,
+                self.__config.cryblend_version, id_, object_.name,
+                bone_names, bone_matrices, joint_indices, counts, groups,
+                weights, buffers.MAX_BONE_INFLUENCES)
+            lines = self.__cache.get_lines(key)
+            if lines is not None:
+                parent_node.appendChild(
+                    daewriter.RawXML("controller", lines))
+                return
+
         controller_node = self.__doc.createElement("controller")
         parent_node.appendChild(controller_node)
         controller_node.setAttribute("id", id_)
@@ -701,9 +698,11 @@ class CrytekDaeExporter:
         utils.write_matrix(Matrix(), bind_shape_matrix)
         skin_node.appendChild(bind_shape_matrix)
 
-        self.__process_bone_joints(object_, armature, skin_node)
-        self.__process_bone_matrices(object_, armature, skin_node)
-        self.__process_bone_weights(object_, armature, skin_node)
+        self.__process_bone_joints(object_, armature, bone_names, skin_node)
+        self.__process_bone_matrices(object_, armature, bone_matrices,
+                                     skin_node)
+        self.__process_bone_weights(object_, armature, joint_indices,
+                                    (counts, groups, weights), skin_node)
 
         joints = self.__doc.createElement("joints")
         input = utils.write_input(id_, None, "joints", "JOINT")
@@ -712,72 +711,77 @@ class CrytekDaeExporter:
         joints.appendChild(input)
         skin_node.appendChild(joints)
 
-    def __process_bone_joints(self, object_, armature, skin_node):
+        if key is not None:
+            self.__cache.put_lines(key,
+                                   daewriter.render_lines(controller_node))
 
+    def __get_bone_names(self, object_, armature):
         bones = utils.get_bones(armature)
-        id_ = "{!s}_{!s}-joints".format(armature.name, object_.name)
         node_name = utils.get_armature_node_name(object_)
         bone_names = []
         for bone in bones:
             props_name = self.__create_props_bone_name(bone, node_name)
             bone_name = "{!s}{!s}".format(bone.name, props_name)
             bone_names.append(bone_name)
-        source = utils.write_source(id_, "IDREF", bone_names, [])
-        skin_node.appendChild(source)
 
-    def __process_bone_matrices(self, object_, armature, skin_node):
+        return bone_names
 
+    def __get_bone_matrices(self, armature):
         bones = utils.get_bones(armature)
         bone_matrices = []
         for bone in bones:
             fakebone = utils.get_fakebone(bone.name)
             if fakebone is None:
-                return
+                return None
             matrix_local = copy.deepcopy(fakebone.matrix_local)
             utils.negate_z_axis_of_matrix(matrix_local)
             bone_matrices.extend(utils.matrix_to_array(matrix_local))
 
-        id_ = "{!s}_{!s}-matrices".format(armature.name, object_.name)
-        source = utils.write_source(id_, "float4x4", bone_matrices, [])
-        skin_node.appendChild(source)
-
-    def __process_bone_weights(self, object_, armature, skin_node):
+        return bone_matrices
 
+    def __get_joint_indices(self, object_, armature):
         bones = utils.get_bones(armature)
-        group_weights = []
-        vw = ""
-        vertex_groups_lengths = ""
-        vertex_count = 0
         bone_list = {}
 
         for bone_id, bone in enumerate(bones):
-            bone_list[bone.name] = bone_id;
+            bone_list[bone.name] = bone_id
 
-        for vertex in object_.data.vertices:
-            vertex_group_count = 0
-            for group in vertex.groups:
-                group_name = object_.vertex_groups[group.group].name
-                if (group.weight == 0 or
-                    group_name not in bone_list):
-                    continue
-                if vertex_group_count == 8:
-                    cbPrint("Too many bone references in {}:{} vertex group"
-                            .format(object_.name, group_name))
-                    continue
-                group_weights.append(group.weight)
-                vw = "{}{} {} ".format(vw, bone_list[group_name], vertex_count)
-                vertex_count += 1
-                vertex_group_count += 1
+        return [bone_list.get(group.name, -1)
+                for group in object_.vertex_groups]
 
-            vertex_groups_lengths = "{}{} ".format(vertex_groups_lengths,
-                                                   vertex_group_count)
+    def __process_bone_joints(self, object_, armature, bone_names,
+                              skin_node):
+        id_ = "{!s}_{!s}-joints".format(armature.name, object_.name)
+        source = utils.write_source(id_, "IDREF", bone_names, [])
+        skin_node.appendChild(source)
+
+    def __process_bone_matrices(self, object_, armature, bone_matrices,
+                                skin_node):
+        if bone_matrices is None:
+            return
+
+        id_ = "{!s}_{!s}-matrices".format(armature.name, object_.name)
+        source = utils.write_source(id_, "float4x4", bone_matrices, [])
+        skin_node.appendChild(source)
+
+    def __process_bone_weights(self, object_, armature, joint_indices,
+                               vertex_group_weights, skin_node):
+        counts, groups, weights = vertex_group_weights
+        vcount, v, group_weights, truncated = buffers.select_bone_influences(
+            counts, groups, weights, joint_indices)
+
+        if truncated:
+            cbPrint("Too many bone references in {}: kept the {} heaviest of"
+                    " {} vertices.".format(object_.name,
+                                           buffers.MAX_BONE_INFLUENCES,
+                                           truncated), 'warning')
 
         id_ = "{!s}_{!s}-weights".format(armature.name, object_.name)
         source = utils.write_source(id_, "float", group_weights, [])
         skin_node.appendChild(source)
 
         vertex_weights = self.__doc.createElement("vertex_weights")
-        vertex_weights.setAttribute("count", str(len(object_.data.vertices)))
+        vertex_weights.setAttribute("count", str(len(counts)))
 
         id_ = "{!s}_{!s}".format(armature.name, object_.name)
         input = utils.write_input(id_, 0, "joints", "JOINT")
@@ -785,15 +789,15 @@ class CrytekDaeExporter:
         input = utils.write_input(id_, 1, "weights", "WEIGHT")
         vertex_weights.appendChild(input)
 
-        vcount = self.__doc.createElement("vcount")
-        vcount_text = self.__doc.createTextNode(vertex_groups_lengths)
-        vcount.appendChild(vcount_text)
-        vertex_weights.appendChild(vcount)
+        vcount_node = self.__doc.createElement("vcount")
+        vcount_text = daewriter.ArrayText(vcount, utils.ints_to_string)
+        vcount_node.appendChild(vcount_text)
+        vertex_weights.appendChild(vcount_node)
 
-        v = self.__doc.createElement("v")
-        v_text = self.__doc.createTextNode(vw)
-        v.appendChild(v_text)
-        vertex_weights.appendChild(v)
+        v_node = self.__doc.createElement("v")
+        v_text = daewriter.ArrayText(v, utils.ints_to_string)
+        v_node.appendChild(v_text)
+        vertex_weights.appendChild(v_node)
 
         skin_node.appendChild(vertex_weights)
 
@@ -810,11 +814,11 @@ class CrytekDaeExporter:
         scene = bpy.context.scene
 
         ALLOWED_NODE_TYPES = ("cga", "anm", "i_caf")
-        for group in utils.get_export_nodes(self.__config.export_selected_nodes):
+        for group in self.__get_export_nodes():
             node_type = utils.get_node_type(group)
             if node_type in ALLOWED_NODE_TYPES:
                 animation_clip = self.__doc.createElement("animation_clip")
-                node_name = utils.get_node_name(group)
+                node_name = self.__get_node_name(group)
                 animation_clip.setAttribute(
                     "id", "{!s}-{!s}".format(node_name, node_name))
                 animation_clip.setAttribute(
@@ -835,62 +839,68 @@ class CrytekDaeExporter:
 
                         props_name = self.__create_props_bone_name(object_, node_name)
                         bone_name = "{!s}{!s}".format(object_.name, props_name)
+                        animation_ids = set()
 
                         for axis in iter(AXES):
                             animation = self.__get_animation_location(
                                 object_, bone_name, axis)
                             if animation is not None:
                                 libanm.appendChild(animation)
+                                animation_ids.add(animation.getAttribute("id"))
 
                         for axis in iter(AXES):
                             animation = self.__get_animation_rotation(
                                 object_, bone_name, axis)
                             if animation is not None:
                                 libanm.appendChild(animation)
+                                animation_ids.add(animation.getAttribute("id"))
 
                         self.__export_instance_animation_parameters(
-                            object_, animation_clip)
+                            object_, animation_clip, animation_ids)
 
                 if is_animation:
                     libanmcl.appendChild(animation_clip)
 
-    def __export_instance_animation_parameters(self, object_, animation_clip):
+    def __export_instance_animation_parameters(self, object_, animation_clip,
+                                               animation_ids):
+        fcurves = self.__get_fcurve_index(object_)
         location_exists = rotation_exists = False
-        for curve in object_.animation_data.action.fcurves:
-            for axis in iter(AXES):
-                if curve.array_index == AXES[axis]:
-                    if curve.data_path == "location":
-                        location_exists = True
-                    if curve.data_path == "rotation_euler":
-                        rotation_exists = True
-                    if location_exists and rotation_exists:
-                        break
+        for axis in iter(AXES):
+            if ("location", AXES[axis]) in fcurves:
+                location_exists = True
+            if ("rotation_euler", AXES[axis]) in fcurves:
+                rotation_exists = True
 
         if location_exists:
             self.__export_instance_parameter(
-                object_, animation_clip, "location")
+                object_, animation_clip, "location", animation_ids)
         if rotation_exists:
             self.__export_instance_parameter(
-                object_, animation_clip, "rotation_euler")
+                object_, animation_clip, "rotation_euler", animation_ids)
 
-    def __export_instance_parameter(self, object_, animation_clip, parameter):
+    def __export_instance_parameter(self, object_, animation_clip, parameter,
+                                    animation_ids):
         for axis in iter(AXES):
+            id_ = "{!s}_{!s}_{!s}".format(object_.name, parameter, axis)
+            # skipped constant channels have no animation to point to
+            if id_ not in animation_ids:
+                continue
             inst = self.__doc.createElement("instance_animation")
-            inst.setAttribute(
-                "url", "#{!s}_{!s}_{!s}".format(
-                    object_.name, parameter, axis))
+            inst.setAttribute("url", "#{!s}".format(id_))
             animation_clip.appendChild(inst)
 
     def __get_animation_location(self, object_, bone_name, axis):
         attribute_type = "location"
         multiplier = 1
         target = "{!s}{!s}{!s}".format(bone_name, "/translation.", axis)
+        tolerance = self.__config.translation_tolerance
 
         animation_element = self.__get_animation_attribute(object_,
                                                            axis,
                                                            attribute_type,
                                                            multiplier,
-                                                           target)
+                                                           target,
+                                                           tolerance)
         return animation_element
 
     def __get_animation_rotation(self, object_, bone_name, axis):
@@ -900,12 +910,14 @@ class CrytekDaeExporter:
                                            "/rotation_",
                                            axis,
                                            ".ANGLE")
+        tolerance = self.__config.rotation_tolerance / utils.to_degrees
 
         animation_element = self.__get_animation_attribute(object_,
                                                            axis,
                                                            attribute_type,
                                                            multiplier,
-                                                           target)
+                                                           target,
+                                                           tolerance)
         return animation_element
 
     def __get_animation_attribute(self,
@@ -913,55 +925,126 @@ class CrytekDaeExporter:
                                   axis,
                                   attribute_type,
                                   multiplier,
-                                  target):
+                                  target,
+                                  tolerance):
         id_prefix = "{!s}_{!s}_{!s}".format(object_.name, attribute_type, axis)
         source_prefix = "#{!s}".format(id_prefix)
 
-        for curve in object_.animation_data.action.fcurves:
-            if (curve.data_path ==
-                    attribute_type and curve.array_index == AXES[axis]):
-                keyframe_points = curve.keyframe_points
-                sources = {
-                    "input": [],
-                    "output": [],
-                    "interpolation": [],
-                    "intangent": [],
-                    "outangent": []
-                }
-                for keyframe_point in keyframe_points:
-                    khlx = keyframe_point.handle_left[0]
-                    khly = keyframe_point.handle_left[1]
-                    khrx = keyframe_point.handle_right[0]
-                    khry = keyframe_point.handle_right[1]
-                    frame, value = keyframe_point.co
-
-                    sources["input"].append(utils.frame_to_time(frame))
-                    sources["output"].append(value * multiplier)
-                    sources["interpolation"].append(
-                        keyframe_point.interpolation)
-                    sources["intangent"].extend(
-                        [utils.frame_to_time(khlx), khly])
-                    sources["outangent"].extend(
-                        [utils.frame_to_time(khrx), khry])
-
-                animation_element = self.__doc.createElement("animation")
-                animation_element.setAttribute("id", id_prefix)
-
-                for type_, data in sources.items():
-                    anim_node = self.__create_animation_node(
-                        type_, data, id_prefix)
-                    animation_element.appendChild(anim_node)
-
-                sampler = self.__create_sampler(id_prefix, source_prefix)
-                channel = self.__doc.createElement("channel")
-                channel.setAttribute(
-                    "source", "{!s}-sampler".format(source_prefix))
-                channel.setAttribute("target", target)
-
-                animation_element.appendChild(sampler)
-                animation_element.appendChild(channel)
-
-                return animation_element
+        curve = self.__get_fcurve_index(object_).get(
+            (attribute_type, AXES[axis]))
+        if curve is None:
+            return None
+
+        keyframes = animation.get_keyframes(curve)
+        if (self.__config.constant_channels != 'KEEP' and
+                animation.is_constant(keyframes)):
+            keyframes = self.__get_constant_keyframes(
+                object_, attribute_type, AXES[axis], keyframes, id_prefix)
+            if not keyframes:
+                return None
+        if self.__config.reduce_keyframes:
+            keyframes = self.__reduce_keyframes(keyframes, tolerance,
+                                                id_prefix)
+
+        frames = []
+        sources = {
+            "input": [],
+            "output": [],
+            "interpolation": [],
+            "intangent": [],
+            "outangent": []
+        }
+        for frame, value, interpolation, handle_left, handle_right in \
+                keyframes:
+            frames.extend((frame, handle_left[0], handle_right[0]))
+            sources["output"].append(value * multiplier)
+            sources["interpolation"].append(interpolation)
+
+        times = utils.frames_to_times(frames)
+        for index, keyframe in enumerate(keyframes):
+            time, left_time, right_time = times[index * 3:index * 3 + 3]
+            sources["input"].append(time)
+            sources["intangent"].extend([left_time, keyframe[3][1]])
+            sources["outangent"].extend([right_time, keyframe[4][1]])
+
+        # baked channels share their key times, write them only once
+        input_source = self.__time_sources.get(tuple(sources["input"]))
+        if input_source is None:
+            input_source = "{!s}-input".format(source_prefix)
+            self.__time_sources[tuple(sources["input"])] = input_source
+        else:
+            del sources["input"]
+
+        animation_element = self.__doc.createElement("animation")
+        animation_element.setAttribute("id", id_prefix)
+
+        for type_, data in sources.items():
+            anim_node = self.__create_animation_node(
+                type_, data, id_prefix)
+            animation_element.appendChild(anim_node)
+
+        sampler = self.__create_sampler(id_prefix, source_prefix,
+                                        input_source)
+        channel = self.__doc.createElement("channel")
+        channel.setAttribute(
+            "source", "{!s}-sampler".format(source_prefix))
+        channel.setAttribute("target", target)
+
+        animation_element.appendChild(sampler)
+        animation_element.appendChild(channel)
+
+        return animation_element
+
+    def __get_fcurve_index(self, object_):
+        action = object_.animation_data.action
+        if action.name not in self.__fcurve_indices:
+            self.__fcurve_indices[action.name] = animation.get_fcurve_index(
+                action)
+
+        return self.__fcurve_indices[action.name]
+
+    def __get_constant_keyframes(self, object_, attribute_type, index,
+                                 keyframes, id_prefix):
+        value = keyframes[0][1]
+        bind_value = self.__get_bind_value(object_, attribute_type, index)
+
+        # a skipped channel falls back to the bind pose of the skeleton
+        if (self.__config.constant_channels == 'SKIP' and
+                bind_value is not None and
+                abs(value - bind_value) <= animation.CONSTANT_EPSILON):
+            cbPrint("{}: constant, skipped.".format(id_prefix))
+            return []
+
+        cbPrint("{}: constant, written as a single key.".format(id_prefix))
+        return animation.get_constant_keyframes(keyframes)
+
+    def __get_bind_value(self, object_, attribute_type, index):
+        '''Returns the rest pose value of a fakebone channel, or None for
+        objects which are not fakebones.
+        '''
+        armature = object_.parent
+        if (not utils.is_fakebone(object_) or armature is None or
+                armature.type != 'ARMATURE'):
+            return None
+
+        if armature.name not in self.__rest_transforms:
+            self.__rest_transforms[armature.name] = \
+                utils.get_rest_transforms(armature)
+        locations, rotations = self.__rest_transforms[armature.name]
+        values = locations if attribute_type == "location" else rotations
+        if object_.parent_bone not in values:
+            return None
+
+        return values[object_.parent_bone][index]
+
+    def __reduce_keyframes(self, keyframes, tolerance, id_prefix):
+        reduced = animation.reduce_keyframes(keyframes, tolerance)
+        removed = len(keyframes) - len(reduced)
+        if removed:
+            cbPrint("{}: removed {} of {} keys.".format(id_prefix, removed,
+                                                       len(keyframes)))
+
+        return reduced
 
     def __create_animation_node(self, type_, data, id_prefix):
         id_ = "{!s}-{!s}".format(id_prefix, type_)
@@ -978,13 +1061,13 @@ class CrytekDaeExporter:
 
         return source
 
-    def __create_sampler(self, id_prefix, source_prefix):
+    def __create_sampler(self, id_prefix, source_prefix, input_source):
         sampler = self.__doc.createElement("sampler")
         sampler.setAttribute("id", "{!s}-sampler".format(id_prefix))
 
         input = self.__doc.createElement("input")
         input.setAttribute("semantic", "INPUT")
-        input.setAttribute("source", "{!s}-input".format(source_prefix))
+        input.setAttribute("source", input_source)
         output = self.__doc.createElement("input")
         output.setAttribute("semantic", "OUTPUT")
         output.setAttribute("source", "{!s}-output".format(source_prefix))
@@ -1022,32 +1105,33 @@ class CrytekDaeExporter:
         current_element.appendChild(visual_scene)
         parent_element.appendChild(current_element)
 
-        if utils.get_export_nodes(self.__config.export_selected_nodes):
+        if self.__get_export_nodes():
             if utils.are_duplicate_nodes():
                 message = "Duplicate Node Names"
-                bpy.ops.screen.display_error('INVOKE_DEFAULT', message=message)
+                cbPrint(message, 'error')
+                self.__errors.append(message)
 
-            for group in utils.get_export_nodes(self.__config.export_selected_nodes):
+            for group in self.__get_export_nodes():
                 self.__write_export_node(group, visual_scene)
         else:
             pass  # TODO: Handle No Export Nodes Error
 
     def __write_export_node(self, group, visual_scene):
         if not self.__config.export_for_lumberyard:
-            node_name = "CryExportNode_{}".format(utils.get_node_name(group))
+            node_name = "CryExportNode_{}".format(self.__get_node_name(group))
             node = self.__doc.createElement("node")
             node.setAttribute("id", node_name)
             node.setIdAttribute("id")
         else:
-            node_name = "{}".format(utils.get_node_name(group))
+            node_name = "{}".format(self.__get_node_name(group))
             node = self.__doc.createElement("node")
             node.setAttribute("id", node_name)
             node.setAttribute("LumberyardExportNode", "1")
             node.setIdAttribute("id")
 
-        bpy.ops.mesh.primitive_cube_add(location=(0, 0, 0))
-        self.__write_transforms(bpy.context.active_object, node)
-        bpy.ops.object.delete(use_global=False)
+        # export nodes are written at the origin
+        self.__write_transform_values((0.0, 0.0, 0.0), (0.0, 0.0, 0.0),
+                                      (1.0, 1.0, 1.0), node)
 
         root_objects = []
         for object_ in group.objects:
@@ -1059,6 +1143,22 @@ class CrytekDaeExporter:
         extra = self.__create_cryengine_extra(group)
         node.appendChild(extra)
         visual_scene.appendChild(node)
+
+    def __get_export_nodes(self):
+        export_nodes = utils.get_export_nodes(
+            self.__config.export_selected_nodes)
+        if self.__clip is None:
+            return export_nodes
+
+        # a clip of a batch export only writes the animation nodes
+        return [group for group in export_nodes
+                if utils.get_node_type(group) == "i_caf"]
+
+    def __get_node_name(self, group):
+        if self.__clip is not None and utils.get_node_type(group) == "i_caf":
+            return self.__clip.name
+
+        return utils.get_node_name(group)
 
     def __write_visual_scene_node(self, objects, parent_node):
         for object_ in objects:
@@ -1169,9 +1269,14 @@ class CrytekDaeExporter:
         return extra
 
     def __write_transforms(self, object_, node):
-        trans = self.__create_translation_node(object_)
-        rotx, roty, rotz = self.__create_rotation_node(object_)
-        scale = self.__create_scale_node(object_)
+        self.__write_transform_values(object_.location,
+                                      object_.rotation_euler,
+                                      object_.scale, node)
+
+    def __write_transform_values(self, location, rotation_euler, scale, node):
+        trans = self.__create_translation_node(location)
+        rotx, roty, rotz = self.__create_rotation_node(rotation_euler)
+        scale = self.__create_scale_node(scale)
 
         node.appendChild(trans)
         node.appendChild(rotx)
@@ -1179,22 +1284,22 @@ class CrytekDaeExporter:
         node.appendChild(rotz)
         node.appendChild(scale)
 
-    def __create_translation_node(self, object_):
+    def __create_translation_node(self, location):
         trans = self.__doc.createElement("translate")
         trans.setAttribute("sid", "translation")
         trans_text = self.__doc.createTextNode("{:f} {:f} {:f}".format(
-            * object_.location))
+            * location))
         trans.appendChild(trans_text)
 
         return trans
 
-    def __create_rotation_node(self, object_):
+    def __create_rotation_node(self, rotation_euler):
         rotx = self.__write_rotation(
-            "X", "1 0 0 {:f}", object_.rotation_euler[0])
+            "X", "1 0 0 {:f}", rotation_euler[0])
         roty = self.__write_rotation(
-            "Y", "0 1 0 {:f}", object_.rotation_euler[1])
+            "Y", "0 1 0 {:f}", rotation_euler[1])
         rotz = self.__write_rotation(
-            "Z", "0 0 1 {:f}", object_.rotation_euler[2])
+            "Z", "0 0 1 {:f}", rotation_euler[2])
 
         return rotx, roty, rotz
 
@@ -1207,14 +1312,14 @@ class CrytekDaeExporter:
 
         return rot
 
-    def __create_scale_node(self, object_):
-        scale = self.__doc.createElement("scale")
-        scale.setAttribute("sid", "scale")
+    def __create_scale_node(self, scale):
+        scale_node = self.__doc.createElement("scale")
+        scale_node.setAttribute("sid", "scale")
         scale_text = self.__doc.createTextNode(
-            utils.floats_to_string(object_.scale, " ", "%s"))
-        scale.appendChild(scale_text)
+            utils.floats_to_string(scale, " ", "%s"))
+        scale_node.appendChild(scale_text)
 
-        return scale
+        return scale_node
 
     def __create_instance(self, object_):
         armature = utils.get_armature_for_object(object_)
@@ -1396,12 +1501,103 @@ def write_scripts(config):
 
 
 def save(config):
+    '''Exports the scene or its animation clips. Returns the messages of
+    the errors which did not stop the export. Blocks until every RC job
+    ended, Blender does not respond meanwhile.
+    '''
     # prevent wasting time for exporting if RC was not found
     if not config.disable_rc and not os.path.isfile(config.rc_path):
         raise exceptions.NoRcSelectedException
 
-    exporter = CrytekDaeExporter(config)
-    exporter.export()
+    # every RC job of the export has ended when the scheduler returns
+    rc_scheduler = create_rc_scheduler(config)
+    try:
+        if config.batch_clips != 'NONE':
+            errors = export_clips(config, rc_scheduler)
+        else:
+            exporter = CrytekDaeExporter(config, rc_scheduler=rc_scheduler)
+            errors = exporter.export()
+    finally:
+        succeeded = rc_scheduler.wait()
+
+    if not succeeded:
+        errors.append(RC_FAILED_MESSAGE)
+
+    return errors
+
+
+def export_clips(config, rc_scheduler):
+    '''Writes one i_caf DAE per animation clip next to the chosen file and
+    adds their RC jobs to the scheduler. The fakebone rig and the libraries
+    which do not depend on the animation are created once, the fakebones
+    are baked again for each clip; the armature action and scene frame
+    range are set for each clip and restored afterwards. Returns the
+    errors of the clip exports like save.
+    '''
+    armature = utils.get_armature()
+    if armature is None or not utils.is_animated_armature(armature):
+        raise exceptions.CryBlendException(
+            "Batch animation export needs an armature in an i_caf node.")
+
+    clips = utils.get_animation_clips(armature, config.batch_clips,
+                                      config.clip_filter)
+    if not clips:
+        cbPrint("No animation clips match {!r}.".format(config.clip_filter),
+                'warning')
+        return []
+
+    scene = bpy.context.scene
+    animation_data = armature.animation_data_create()
+    frame_start = scene.frame_start
+    frame_end = scene.frame_end
+    action = animation_data.action
+    use_nla = animation_data.use_nla
+    output_path = os.path.dirname(
+        bpy.path.ensure_ext(config.filepath, ".dae"))
+
+    # textures are converted once, with the shared libraries
+    clips_config = copy.copy(config)
+    clips_config.do_textures = False
+
+    errors = []
+    utils.add_fakebones(animate=False)
+    try:
+        # the skin is bound to the rest pose, before any clip is baked
+        start_time = clock()
+        shared_libraries = CrytekDaeExporter(
+            config, clips[0], rc_scheduler).export_shared_libraries()
+        cbPrint("Shared libraries took {:.4f} sec.".format(
+            clock() - start_time))
+
+        armature.data.pose_position = 'POSE'
+        animation_data.use_nla = False
+        utils.select_all()
+
+        for clip in clips:
+            cbPrint("Exporting clip {} ({} - {}).".format(
+                clip.name, clip.frame_start, clip.frame_end))
+            animation_data.action = clip.action
+            scene.frame_start = clip.frame_start
+            scene.frame_end = clip.frame_end
+            utils.bake_fakebones(armature)
+
+            clip_config = copy.copy(clips_config)
+            clip_config.filepath = os.path.join(output_path,
+                                                "{}.dae".format(clip.name))
+
+            exporter = CrytekDaeExporter(clip_config, clip, rc_scheduler,
+                                         shared_libraries)
+            for message in exporter.export():
+                errors.append("{}: {}".format(clip.name, message))
+
+    finally:
+        utils.remove_fakebones()
+        scene.frame_start = frame_start
+        scene.frame_end = frame_end
+        animation_data.action = action
+        animation_data.use_nla = use_nla
+
+    return errors
 
 
 def register():
@@ -0,0 +1,341 @@
+#------------------------------------------------------------------------------
+# Name:        geometry.py
+# Purpose:     Writes <geometry> elements from extracted mesh buffers
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) CryBlend Team 2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+if "bpy" in locals():
+    import imp
+    imp.reload(utils)
+    imp.reload(daewriter)
+    imp.reload(cache)
+    imp.reload(buffers)
+else:
+    import bpy
+    from io_export_cryblend import utils, daewriter, cache, buffers
+
+from io_export_cryblend.outpipe import cbPrint
+from concurrent.futures import ProcessPoolExecutor
+from time import clock
+from array import array
+from xml.dom.minidom import Document
+import multiprocessing
+import os
+
+
+# Smaller scenes are formatted on the main thread, starting worker
+# processes would take longer than the formatting itself.
+PARALLEL_VERTEX_THRESHOLD = 50000
+
+
+class GeometryData:
+    '''Everything needed to write the <geometry> of one object. It is
+    extracted from bpy on the main thread and only holds plain Python data,
+    so it can be sent to worker processes.
+    '''
+
+    def __init__(self, name, mesh_buffers, average_planar, colors,
+                 color_params, material_names, with_colors,
+                 weld_tolerance=None):
+        self.name = name
+        self.mesh_buffers = mesh_buffers
+        self.average_planar = average_planar
+        self.colors = colors
+        self.color_params = color_params
+        self.material_names = material_names
+        self.with_colors = with_colors
+        # None writes one entry per corner, otherwise equal entries merge
+        self.weld_tolerance = weld_tolerance
+
+    @property
+    def vertex_count(self):
+        return len(self.mesh_buffers.positions) // 3
+
+    def get_cache_key(self, *settings):
+        '''Hashes everything the <geometry> element is written from.'''
+        mesh_buffers = self.mesh_buffers
+        return cache.hash_key(
+            "geometry", cache.FORMAT_VERSION, settings, self.name,
+            mesh_buffers.positions, mesh_buffers.vertex_normals,
+            mesh_buffers.face_sizes, mesh_buffers.face_vertices,
+            mesh_buffers.face_normals, mesh_buffers.face_smooth,
+            mesh_buffers.face_materials, len(mesh_buffers.uv_layers),
+            mesh_buffers.get_uvs(), array('d', self.colors),
+            self.color_params, self.average_planar, self.material_names,
+            self.with_colors, self.weld_tolerance)
+
+
+class WeldedAttributes:
+    '''Normals, UVs and colors of a geometry with equal entries merged, and
+    the (normal, texcoord, color) indices of every corner into them.
+    '''
+
+    def __init__(self, data):
+        tolerance = data.weld_tolerance
+        mesh_buffers = data.mesh_buffers
+        corner_count = len(mesh_buffers.face_vertices)
+
+        self.normals, normal_indices = buffers.weld(
+            mesh_buffers.get_corner_normal_values(data.average_planar), 3,
+            tolerance)
+        self.uvs, uv_indices = buffers.weld(mesh_buffers.get_uvs(), 2,
+                                            tolerance)
+
+        self.colors = data.colors
+        color_indices = array('i')
+        color_size = len(data.color_params)
+        if data.colors and len(data.colors) % color_size == 0:
+            self.colors, color_indices = buffers.weld(data.colors,
+                                                      color_size, tolerance)
+
+        self.indices = (normal_indices,
+                        self.__get_corner_indices(uv_indices, corner_count),
+                        self.__get_corner_indices(color_indices,
+                                                  corner_count))
+
+    def __get_corner_indices(self, indices, corner_count):
+        # meshes without the layer keep pointing every corner at its own
+        # entry, as without welding
+        if len(indices) < corner_count:
+            return array('i', range(corner_count))
+
+        return indices
+
+
+#------------------------------------------------------------------------------
+# Parallel Formatting:
+#------------------------------------------------------------------------------
+
+def write_geometries(geometries, workers):
+    '''Returns the <geometry> elements of all GeometryData in their order.
+    When the scene is formatted by a process pool the elements are
+    daewriter.RawXML.
+    '''
+    if __use_pool(geometries, workers):
+        return [daewriter.RawXML("geometry", lines)
+                for lines in render_geometries(geometries, workers)]
+
+    return [write_geometry(data) for data in geometries]
+
+
+def render_geometries(geometries, workers):
+    '''Returns the <geometry> elements of all GeometryData in their order,
+    formatted as lines of XML.
+    '''
+    if not __use_pool(geometries, workers):
+        return [daewriter.render_lines(write_geometry(data))
+                for data in geometries]
+
+    workers = min(get_worker_count(geometries, workers), len(geometries))
+    cbPrint("Formatting geometries in {} processes.".format(workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map keeps the order of the objects, whichever finishes first
+        results = list(executor.map(render_geometry, geometries))
+
+    rendered = []
+    for lines, timings in results:
+        __print_timings(timings)
+        rendered.append(lines)
+
+    return rendered
+
+
+def get_worker_count(geometries, workers):
+    '''Returns the number of processes to use, 0 workers means one per
+    core.
+    '''
+    vertex_count = sum(data.vertex_count for data in geometries)
+    if vertex_count < PARALLEL_VERTEX_THRESHOLD:
+        return 1
+    if workers == 0:
+        return os.cpu_count() or 1
+
+    return workers
+
+
+def render_geometry(data):
+    '''Formats the <geometry> element as lines of XML. Runs in the worker
+    processes, which must not print: a fork only copies the thread that
+    forked, a stdout lock held by another thread would never be released.
+    Returns the lines and the timings for the parent to report.
+    '''
+    geometry_node, timings = __build_geometry(data)
+    return daewriter.render_lines(geometry_node), timings
+
+
+def __use_pool(geometries, workers):
+    # Worker processes are only forked, on other platforms they would start
+    # a new Blender, so everything is built on the main thread there.
+    return (len(geometries) > 1 and
+            get_worker_count(geometries, workers) > 1 and
+            multiprocessing.get_start_method() == 'fork')
+
+
+#------------------------------------------------------------------------------
+# Geometry Elements:
+#------------------------------------------------------------------------------
+
+def write_geometry(data):
+    geometry_node, timings = __build_geometry(data)
+    __print_timings(timings)
+
+    return geometry_node
+
+
+def __build_geometry(data):
+    # returns the element and (part, seconds) pairs instead of printing,
+    # it runs in the worker processes too
+    timings = []
+    doc = Document()
+    geometry_node = doc.createElement("geometry")
+    geometry_node.setAttribute("id", data.name)
+    mesh_node = doc.createElement("mesh")
+
+    welded = None
+    if data.weld_tolerance is not None:
+        start_time = clock()
+        welded = WeldedAttributes(data)
+        timings.append(('Welding', clock() - start_time))
+
+    start_time = clock()
+    __write_positions(data, mesh_node)
+    timings.append(('Positions', clock() - start_time))
+
+    start_time = clock()
+    __write_normals(data, welded, mesh_node)
+    timings.append(('Normals', clock() - start_time))
+
+    start_time = clock()
+    __write_uvs(data, welded, mesh_node)
+    timings.append(('UVs', clock() - start_time))
+
+    start_time = clock()
+    __write_vertex_colors(data, welded, mesh_node)
+    timings.append(('Vertex colors', clock() - start_time))
+
+    start_time = clock()
+    __write_vertices(doc, data, mesh_node)
+    timings.append(('Vertices', clock() - start_time))
+
+    start_time = clock()
+    __write_polylist(doc, data, welded, mesh_node)
+    timings.append(('Polylist', clock() - start_time))
+
+    extra = __create_double_sided_extra(doc, "MAYA")
+    mesh_node.appendChild(extra)
+    geometry_node.appendChild(mesh_node)
+
+    return geometry_node, timings
+
+
+def __print_timings(timings):
+    for part, seconds in timings:
+        cbPrint('{} took {:.4f} sec.'.format(part, seconds))
+
+
+def __write_positions(data, root):
+    id_ = "{!s}-positions".format(data.name)
+    source = utils.write_source(id_, "float", data.mesh_buffers.positions,
+                                "XYZ")
+    root.appendChild(source)
+
+
+def __write_normals(data, welded, root):
+    if welded is None:
+        float_normals = data.mesh_buffers.get_corner_normals(
+            data.average_planar)
+    else:
+        float_normals = welded.normals
+
+    id_ = "{!s}-normals".format(data.name)
+    source = utils.write_source(id_, "float", float_normals, "XYZ")
+    root.appendChild(source)
+
+
+def __write_uvs(data, welded, root):
+    if welded is None:
+        uvs = data.mesh_buffers.get_uvs()
+    else:
+        uvs = welded.uvs
+
+    id_ = "{!s}-UVMap-0".format(data.name)
+    source = utils.write_source(id_, "float", uvs, "ST")
+    root.appendChild(source)
+
+
+def __write_vertex_colors(data, welded, root):
+    if data.colors:
+        colors = data.colors if welded is None else welded.colors
+        id_ = "{!s}-colors".format(data.name)
+        source = utils.write_source(id_, "float", colors, data.color_params)
+        root.appendChild(source)
+
+
+def __write_vertices(doc, data, root):
+    vertices = doc.createElement("vertices")
+    vertices.setAttribute("id", "{}-vertices".format(data.name))
+    input = utils.write_input(data.name, None, "positions", "POSITION")
+    vertices.appendChild(input)
+    root.appendChild(vertices)
+
+
+def __write_polylist(doc, data, welded, root):
+    welded_indices = None if welded is None else welded.indices
+    polylists = data.mesh_buffers.get_polylists(len(data.material_names),
+                                                data.with_colors,
+                                                welded_indices)
+
+    for materialname, (verts_per_poly, vert_data) in zip(
+            data.material_names, polylists):
+        if not verts_per_poly:
+            continue
+
+        polylist = doc.createElement('polylist')
+        polylist.setAttribute('material', materialname)
+        polylist.setAttribute('count', str(len(verts_per_poly)))
+
+        inputs = []
+        inputs.append(utils.write_input(data.name, 0, 'vertices', 'VERTEX'))
+        inputs.append(utils.write_input(data.name, 1, 'normals', 'NORMAL'))
+        inputs.append(utils.write_input(data.name, 2, 'UVMap-0', 'TEXCOORD'))
+        if data.with_colors:
+            inputs.append(utils.write_input(data.name, 3, 'colors', 'COLOR'))
+
+        for input in inputs:
+            polylist.appendChild(input)
+
+        vcount = doc.createElement('vcount')
+        vcount_text = daewriter.ArrayText(verts_per_poly,
+                                          utils.ints_to_string)
+        vcount.appendChild(vcount_text)
+
+        p = doc.createElement('p')
+        p_text = daewriter.ArrayText(vert_data, utils.ints_to_string)
+        p.appendChild(p_text)
+
+        polylist.appendChild(vcount)
+        polylist.appendChild(p)
+        root.appendChild(polylist)
+
+
+def __create_double_sided_extra(doc, profile):
+    extra = doc.createElement("extra")
+    technique = doc.createElement("technique")
+    technique.setAttribute("profile", profile)
+    double_sided = doc.createElement("double_sided")
+    double_sided_value = doc.createTextNode("1")
+    double_sided.appendChild(double_sided_value)
+    technique.appendChild(double_sided)
+    extra.appendChild(technique)
+
+    return extra
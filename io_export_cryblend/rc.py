@@ -17,33 +17,275 @@
 if "bpy" in locals():
     import imp
     imp.reload(utils)
+    imp.reload(exceptions)
+    imp.reload(cache)
 else:
     import bpy
-    from io_export_cryblend import utils
+    from io_export_cryblend import utils, exceptions, cache
 
 from io_export_cryblend.outpipe import cbPrint
+from collections import deque
+from functools import partial
+from xml.dom.minidom import Document
 import fnmatch
 import os
 import shutil
 import subprocess
 import threading
 import tempfile
+import time
+
+
+# Scheduler group of the texture conversions, limited by the
+# "Texture Workers" option.
+TEXTURE_GROUP = "textures"
 
 
 class RCInstance:
 
-    def __init__(self, config):
+    def __init__(self, config, scheduler):
         self.__config = config
+        self.__scheduler = scheduler
 
     def convert_tif(self, source):
         converter = _TIFConverter(self.__config, source)
-        conversion_thread = threading.Thread(target=converter)
-        conversion_thread.start()
+        converter.add_jobs(self.__scheduler)
 
     def convert_dae(self, source):
         converter = _DAEConverter(self.__config, source)
-        conversion_thread = threading.Thread(target=converter)
-        conversion_thread.start()
+        converter.add_jobs(self.__scheduler)
+
+
+#------------------------------------------------------------------------------
+# Job Scheduler:
+#------------------------------------------------------------------------------
+
+def create_rc_scheduler(config):
+    limits = {}
+    if config.texture_workers:
+        limits[TEXTURE_GROUP] = config.texture_workers
+
+    return RCScheduler(config.rc_workers, limits)
+
+
+class RCJob:
+    '''A job of the RCScheduler, either a resource compiler run or a Python
+    function. RC jobs fail with a non-zero exit code, function jobs when
+    they raise.
+    '''
+
+    def __init__(self, name, function, rc_args, dependencies, after_failure,
+                 group, artifacts=None):
+        self.name = name
+        self.function = function
+        self.rc_args = rc_args
+        self.group = group
+        self.artifacts = artifacts
+        self.restored = False
+        self.dependencies = list(dependencies)
+        self.after_failure = after_failure
+        self.return_code = None
+        self.error = None
+        self.skipped = False
+        self.finished = False
+        self.duration = 0.0
+
+    @property
+    def succeeded(self):
+        return (self.finished and not self.skipped and self.error is None and
+                not self.return_code)
+
+    def get_status(self):
+        if self.skipped:
+            return "skipped"
+        if self.restored:
+            return "restored from cache"
+        if self.error is not None:
+            return "failed: {}".format(self.error)
+        if self.return_code is not None:
+            return "exit code {}".format(self.return_code)
+
+        return "done"
+
+
+class RCScheduler:
+    '''Runs the RC jobs of an export in a fixed number of worker threads.
+    A job starts once all its dependencies finished and is skipped when one
+    of them failed, unless it runs after failures. Jobs of a group in limits
+    do not run more often at once than its limit. Each RC run gets a share
+    of the cores, so the parallel runs do not oversubscribe the machine.
+
+    wait() is the end of the export: it returns once every job ended and
+    reports their exit codes and durations. It is called on Blender's main
+    thread, so Blender does not respond until the RC is done. Jobs run
+    outside of it and must not use bpy, everything they need from the scene
+    is read when they are added.
+    '''
+
+    def __init__(self, workers=0, limits=None):
+        self.__cores = os.cpu_count() or 1
+        self.__workers = workers or self.__cores
+        self.__limits = limits or {}
+        self.__running_groups = {}
+        self.__condition = threading.Condition()
+        self.__jobs = []
+        self.__pending = []
+        self.__ready = deque()
+        self.__unfinished = 0
+        self.__running_rc = 0
+        self.__closed = False
+        self.__start_time = time.time()
+
+        self.__threads = []
+        for index in range(self.__workers):
+            thread = threading.Thread(target=self.__run, daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def add(self, name, function, dependencies=(), after_failure=False,
+            group=None):
+        job = RCJob(name, function, None, dependencies, after_failure, group)
+        return self.__add(job)
+
+    def add_rc(self, name, rc_path, files, params, dependencies=(),
+               after_failure=False, group=None, artifacts=None):
+        '''Adds a resource compiler run, the thread count parameter is added
+        when the job starts. With cache.RCArtifacts the outputs are restored
+        from the artifact cache when possible, otherwise they are stored
+        after a successful run.
+        '''
+        job = RCJob(name, None, (rc_path, files, params), dependencies,
+                    after_failure, group, artifacts)
+        return self.__add(job)
+
+    def wait(self):
+        '''Blocks until all jobs ended and prints the report. Returns
+        whether every job succeeded. No jobs can be added afterwards.
+        '''
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+            if self.__unfinished:
+                cbPrint("Waiting for {} RC jobs...".format(self.__unfinished))
+            while self.__unfinished:
+                self.__condition.wait()
+
+        for thread in self.__threads:
+            thread.join()
+
+        self.__report()
+        return all(job.succeeded for job in self.__jobs)
+
+    def __add(self, job):
+        with self.__condition:
+            if self.__closed:
+                raise exceptions.CryBlendException(
+                    "RC job {!r} added after the export finished.".format(
+                        job.name))
+            self.__jobs.append(job)
+            self.__pending.append(job)
+            self.__unfinished += 1
+            self.__update_pending()
+            self.__condition.notify_all()
+
+        return job
+
+    def __update_pending(self):
+        # skipping a job can make its dependents ready, repeat until stable
+        changed = True
+        while changed:
+            changed = False
+            for job in list(self.__pending):
+                if not all(dependency.finished
+                           for dependency in job.dependencies):
+                    continue
+
+                self.__pending.remove(job)
+                changed = True
+                if job.after_failure or all(dependency.succeeded
+                                            for dependency in
+                                            job.dependencies):
+                    self.__ready.append(job)
+                else:
+                    job.skipped = True
+                    job.finished = True
+                    self.__unfinished -= 1
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                job = self.__pop_ready_job()
+                while job is None:
+                    if self.__closed and not self.__unfinished:
+                        return
+                    self.__condition.wait()
+                    job = self.__pop_ready_job()
+
+                self.__running_groups[job.group] = (
+                    self.__running_groups.get(job.group, 0) + 1)
+                threads = 0
+                if job.rc_args is not None:
+                    threads = self.__get_rc_threads()
+                    self.__running_rc += 1
+
+            self.__execute(job, threads)
+
+            with self.__condition:
+                if job.rc_args is not None:
+                    self.__running_rc -= 1
+                self.__running_groups[job.group] -= 1
+                job.finished = True
+                self.__unfinished -= 1
+                self.__update_pending()
+                self.__condition.notify_all()
+
+    def __pop_ready_job(self):
+        for job in self.__ready:
+            limit = self.__limits.get(job.group)
+            if limit is None or self.__running_groups.get(job.group,
+                                                          0) < limit:
+                self.__ready.remove(job)
+                return job
+
+        return None
+
+    def __get_rc_threads(self):
+        ready_rc = sum(1 for job in self.__ready if job.rc_args is not None)
+        parallel = min(self.__workers, self.__running_rc + ready_rc + 1)
+        return max(1, self.__cores // parallel)
+
+    def __execute(self, job, threads):
+        start_time = time.time()
+        try:
+            if job.artifacts is not None and job.artifacts.restore():
+                job.restored = True
+                job.return_code = 0
+            elif job.rc_args is not None:
+                rc_path, files, params = job.rc_args
+                params = params + ["/threads={}".format(threads)]
+                job.return_code = run_rc(rc_path, files, params).wait()
+                if job.return_code == 0 and job.artifacts is not None:
+                    job.artifacts.store()
+            else:
+                job.function()
+        except Exception as exception:
+            job.error = exception
+        job.duration = time.time() - start_time
+
+    def __report(self):
+        for job in self.__jobs:
+            message_type = 'info' if job.succeeded else 'warning'
+            cbPrint("RC job {!r}: {} in {:.2f} sec.".format(
+                job.name, job.get_status(), job.duration), message_type)
+
+        succeeded = sum(1 for job in self.__jobs if job.succeeded)
+        skipped = sum(1 for job in self.__jobs if job.skipped)
+        restored = sum(1 for job in self.__jobs if job.restored)
+        failed = len(self.__jobs) - succeeded - skipped
+        cbPrint("Export finished: {} RC jobs succeeded ({} from cache), {}"
+                " failed, {} skipped in {:.2f} sec.".format(
+                    succeeded, restored, failed, skipped,
+                    time.time() - self.__start_time))
 
 
 class _DAEConverter:
@@ -52,70 +294,106 @@ class _DAEConverter:
         self.__config = config
         self.__doc = source
 
-    def __call__(self):
+    def add_jobs(self, scheduler):
         filepath = bpy.path.ensure_ext(self.__config.filepath, ".dae")
-        utils.generate_xml(filepath, self.__doc, overwrite=True)
-
+        name = os.path.basename(filepath)
         dae_path = utils.get_absolute_path_for_rc(filepath)
+        jobs = []
+
+        # streamed documents are already written by the exporter
+        if self.__doc is not None:
+            jobs.append(scheduler.add(
+                "Write {}".format(name),
+                partial(utils.generate_xml, filepath, self.__doc,
+                        overwrite=True)))
 
         if not self.__config.disable_rc:
-            rc_params = ["/verbose", "/threads=processors", "/refresh"]
+            rc_params = ["/verbose", "/refresh"]
             if self.__config.do_materials:
                 rc_params.append("/createmtl=1")
 
-            rc_process = run_rc(self.__config.rc_path, dae_path, rc_params)
-
-            if rc_process is not None:
-                rc_process.wait()
-                self.__recompile(dae_path)
+            artifacts = self.__get_artifacts(filepath, rc_params)
+            rc_job = scheduler.add_rc("RC {}".format(name),
+                                      self.__config.rc_path, dae_path,
+                                      rc_params, jobs, artifacts=artifacts)
+            jobs.append(rc_job)
+            jobs.extend(self.__add_recompile_jobs(scheduler, dae_path,
+                                                  rc_job))
 
             if self.__config.do_materials:
-                mtl_fix_thread = threading.Thread(
-                    target=self.__fix_normalmap_in_mtls,
-                    args=(rc_process, filepath)
-                )
-                mtl_fix_thread.start()
+                jobs.append(scheduler.add(
+                    "Fix normal maps of {}".format(name),
+                    partial(self.__fix_normalmap_in_mtls, filepath),
+                    [rc_job]))
 
         if self.__config.make_layer:
-            lyr_contents = self.__make_layer()
             lyr_path = os.path.splitext(filepath)[0] + ".lyr"
-            utils.generate_file(lyr_path, lyr_contents)
+            # worker threads must not touch bpy, the layer reads the scene
+            lyr_contents = self.__make_layer()
+            scheduler.add("Write {}".format(os.path.basename(lyr_path)),
+                          partial(utils.generate_file, lyr_path,
+                                  lyr_contents))
 
         if not self.__config.save_dae:
-            rcdone_path = "{}.rcdone".format(dae_path)
-            utils.remove_file(dae_path)
-            utils.remove_file(rcdone_path)
-
-    def __recompile(self, dae_path):
-        name = os.path.basename(dae_path)
+            scheduler.add("Remove {}".format(name),
+                          partial(self.__remove_dae, dae_path), jobs,
+                          after_failure=True)
+
+    def __get_artifacts(self, filepath, rc_params):
+        artifact_cache = cache.create_artifact_cache(self.__config)
+        if artifact_cache is None:
+            return None
+
+        # outputs are named after the export nodes, clips after their DAE
+        output_names = [utils.get_node_name(group)
+                        for group in utils.get_export_nodes()]
+        output_names.append(os.path.splitext(os.path.basename(filepath))[0])
+
+        return cache.RCArtifacts(artifact_cache,
+                                 utils.get_absolute_path(filepath),
+                                 self.__config.rc_path, rc_params,
+                                 output_names)
+
+    def __remove_dae(self, dae_path):
+        rcdone_path = "{}.rcdone".format(dae_path)
+        utils.remove_file(dae_path)
+        utils.remove_file(rcdone_path)
+
+    def __add_recompile_jobs(self, scheduler, dae_path, rc_job):
         output_path = os.path.dirname(dae_path)
         ALLOWED_NODE_TYPES = ("chr", "skin")
+        jobs = []
         for group in utils.get_export_nodes():
             node_type = utils.get_node_type(group)
             if node_type in ALLOWED_NODE_TYPES:
                 out_file = os.path.join(output_path, group.name)
-                args = [self.__config.rc_path, "/refresh", "/vertexindexformat=u16", out_file]
-                rc_second_pass = subprocess.Popen(args)
+                params = ["/refresh", "/vertexindexformat=u16"]
+                jobs.append(scheduler.add_rc(
+                    "Recompile {}".format(group.name),
+                    self.__config.rc_path, out_file, params, [rc_job]))
             elif node_type == 'i_caf':
-                try:
-                    os.remove(os.path.join(output_path, ".animsettings"))
-                    os.remove(os.path.join(output_path, ".caf"))
-                    os.remove(os.path.join(output_path, ".$animsettings"))
-                except:
-                    pass
+                jobs.append(scheduler.add(
+                    "Remove animation settings",
+                    partial(self.__remove_animation_settings, output_path),
+                    [rc_job], after_failure=True))
 
-    def __fix_normalmap_in_mtls(self, rc_process, dae_file):
-        SUCCESS = 0
+        return jobs
 
-        return_code = rc_process.wait()
+    def __remove_animation_settings(self, output_path):
+        try:
+            os.remove(os.path.join(output_path, ".animsettings"))
+            os.remove(os.path.join(output_path, ".caf"))
+            os.remove(os.path.join(output_path, ".$animsettings"))
+        except:
+            pass
 
-        if return_code == SUCCESS:
-            export_directory = os.path.dirname(dae_file)
+    def __fix_normalmap_in_mtls(self, dae_file):
+        export_directory = os.path.dirname(dae_file)
 
-            mtl_files = self.__get_mtl_files_in_directory(export_directory)
+        mtl_files = self.__get_mtl_files_in_directory(export_directory)
 
-            for mtl_file_name in mtl_files:
-                self.__fix_normalmap_in_mtl(mtl_file_name)
+        for mtl_file_name in mtl_files:
+            self.__fix_normalmap_in_mtl(mtl_file_name)
 
     def __get_mtl_files_in_directory(self, directory):
         MTL_MATCH_STRING = "*.{!s}".format("mtl")
@@ -151,7 +429,7 @@ class _DAEConverter:
         layer_doc = Document()
         object_layer = layer_doc.createElement("ObjectLayer")
         layer_name = "ExportedLayer"
-        layer = createAttributes(
+        layer = self.__createAttributes(
             'Layer',
             {'name': layer_name,
              'GUID': utils.get_guid(),
@@ -175,15 +453,15 @@ class _DAEConverter:
                 origin = group.objects[0].location
                 rotation = group.objects[0].delta_rotation_quaternion
 
-            object = createAttributes(
+            object = self.__createAttributes(
                 'Object',
                 {'name': group.name[14:],
                  'Type': 'Entity',
                  'Id': utils.get_guid(),
                  'LayerGUID': layer.getAttribute('GUID'),
                  'Layer': layer_name,
-                 'Pos': "{}, {}, {}".format(origin[:]),
-                 'Rotate': "{}, {}, {}, {}".format(rotation[:]),
+                 'Pos': "{}, {}, {}".format(*origin[:]),
+                 'Rotate': "{}, {}, {}, {}".format(*rotation[:]),
                  'EntityClass': 'BasicEntity',
                  'FloorNumber': '-1',
                  'RenderNearest': '0',
@@ -198,7 +476,7 @@ class _DAEConverter:
                  'HiddenInGame': '0',
                  }
             )
-            properties = createAttributes(
+            properties = self.__createAttributes(
                 'Properties',
                 {'object_Model': '/Objects/{}.cgf'.format(group.name[14:]),
                  'bCanTriggerAreas': '0',
@@ -214,14 +492,14 @@ class _DAEConverter:
                  'UseMessage': '0',
                  }
             )
-            health = createAttributes(
+            health = self.__createAttributes(
                 'Health',
                 {'bInvulnerable': '1',
                  'MaxHealth': '500',
                  'bOnlyEnemyFire': '1',
                  }
             )
-            interest = createAttributes(
+            interest = self.__createAttributes(
                 'Interest',
                 {'soaction_Action': '',
                  'bInteresting': '0',
@@ -231,7 +509,7 @@ class _DAEConverter:
                  'bShared': '0',
                  }
             )
-            vOffset = createAttributes(
+            vOffset = self.__createAttributes(
                 'vOffset',
                 {'x': '0',
                  'y': '0',
@@ -251,13 +529,13 @@ class _DAEConverter:
 
         return layer_doc.toprettyxml(indent="    ")
 
-        def __createAttributes(self, node_name, attributes):
-            doc = Document()
-            node = doc.createElement(node_name)
-            for name, value in attributes.items():
-                node.setAttribute(name, value)
+    def __createAttributes(self, node_name, attributes):
+        doc = Document()
+        node = doc.createElement(node_name)
+        for name, value in attributes.items():
+            node.setAttribute(name, value)
 
-            return node
+        return node
 
 
 class _TIFConverter:
@@ -267,10 +545,27 @@ class _TIFConverter:
         self.__images_to_convert = source
         self.__tmp_images = {}
         self.__tmp_dir = tempfile.mkdtemp("CryBlend")
-
-    def __call__(self):
+        self.__texture_cache = cache.create_texture_cache(config)
+        self.__conversions = []
+
+    def add_jobs(self, scheduler):
+        '''Saves the TIFFs on the main thread and adds one RC job per
+        image. Images whose DDS is up to date are skipped. The temporary
+        files are moved or removed once every conversion ended.
+        '''
+        jobs = []
         for image in self.__images_to_convert:
             rc_params = self.__get_rc_params(image.filepath)
+            dds_path = utils.get_path_with_new_extension(
+                utils.get_absolute_path(image.filepath), "dds")
+            source_hash = self.__get_source_hash(image)
+            cache_params = [self.__config.texture_rc_path] + rc_params
+            if (self.__texture_cache is not None and
+                    self.__texture_cache.is_up_to_date(dds_path, source_hash,
+                                                       cache_params)):
+                cbPrint("DDS of {!r} is up to date.".format(image.name))
+                continue
+
             tiff_image_path = self.__get_temp_tiff_image_path(image)
 
             tiff_image_for_rc = utils.get_absolute_path_for_rc(tiff_image_path)
@@ -281,11 +576,15 @@ class _TIFConverter:
             except:
                 cbPrint("Failed to invert green channel")
 
-            rc_process = run_rc(self.__config.texture_rc_path,
-                                tiff_image_for_rc,
-                                rc_params)
+            job = scheduler.add_rc(
+                "Convert {}".format(image.name),
+                self.__config.texture_rc_path, tiff_image_for_rc, rc_params,
+                group=TEXTURE_GROUP)
+            jobs.append(job)
+            self.__conversions.append((job, dds_path, source_hash,
+                                       cache_params))
 
-            # re-save the original image after running the RC to
+            # re-save the original image after starting the RC to
             # prevent the original one from getting lost
             try:
                 if ("_ddn" in image.name):
@@ -293,13 +592,34 @@ class _TIFConverter:
             except:
                 cbPrint("Failed to invert green channel")
 
-            rc_process.wait()
+        scheduler.add("Clean up textures", self.__finish, jobs,
+                      after_failure=True)
 
+    def __finish(self):
         if self.__config.texture_rc_path:
             self.__save_tiffs()
 
         self.__remove_tmp_files()
 
+        if self.__texture_cache is None:
+            return
+
+        for job, dds_path, source_hash, cache_params in self.__conversions:
+            if job.succeeded:
+                self.__texture_cache.record(dds_path, source_hash,
+                                            cache_params)
+        self.__texture_cache.save()
+        self.__texture_cache.report()
+
+    def __get_source_hash(self, image):
+        # unsaved changes are only in memory, they are always converted
+        if image.is_dirty:
+            return None
+        if image.packed_file is not None:
+            return cache.hash_key(image.packed_file.data)
+
+        return cache.hash_file(utils.get_absolute_path(image.filepath))
+
     def __create_normal_texture(self):
         if ("_ddn" in image.name):
             # make a copy to prevent editing the original image
@@ -314,7 +634,7 @@ class _TIFConverter:
             bpy.data.images.remove(temp_normal_image)
 
     def __get_rc_params(self, destination_path):
-        rc_params = ["/verbose", "/threads=cores", "/userdialog=1", "/refresh"]
+        rc_params = ["/verbose", "/userdialog=1", "/refresh"]
 
         image_directory = os.path.dirname(utils.get_absolute_path_for_rc(
             destination_path))
@@ -344,7 +664,11 @@ class _TIFConverter:
         tiff_image_absolute_path = utils.get_absolute_path(tiff_image_path)
         tiff_file_name = os.path.basename(tiff_image_path)
 
-        tmp_file_path = os.path.join(self.__tmp_dir, tiff_file_name)
+        # every TIFF is saved before the conversions start, so images of
+        # the same name get their own directory; the RC names the DDS after
+        # the file name, which is kept
+        tmp_file_path = os.path.join(tempfile.mkdtemp(dir=self.__tmp_dir),
+                                     tiff_file_name)
 
         if tiff_image_path != image.filepath:
             self.__save_as_tiff(image, tmp_file_path)
@@ -378,7 +702,7 @@ class _TIFConverter:
             except FileNotFoundError:
                 pass
 
-        os.removedirs(self.__tmp_dir)
+        shutil.rmtree(self.__tmp_dir, ignore_errors=True)
         self.__tmp_images.clear()
 
 
@@ -0,0 +1,241 @@
+#------------------------------------------------------------------------------
+# Name:        skeleton.py
+# Purpose:     Bone transforms evaluated from armature data, without
+#              operators or scene updates
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) CryBlend Team 2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from mathutils import Euler, Matrix, Quaternion, Vector
+
+
+#------------------------------------------------------------------------------
+# Rest Pose:
+#------------------------------------------------------------------------------
+
+class RestBone:
+    '''Rest transform of a bone with the same attributes as the fakebone
+    which add_fakebones would create for it: a helper placed at the bone
+    head, without rotation and scale, parented to the armature.
+    '''
+
+    def __init__(self, armature, bone):
+        self.name = bone.name
+        self.location = bone.head_local.copy()
+        self.rotation_euler = Euler((0.0, 0.0, 0.0))
+        self.scale = Vector((1.0, 1.0, 1.0))
+        self.matrix_world = Matrix.Translation(self.location)
+        self.matrix_local = (armature.matrix_world.inverted() *
+                             self.matrix_world)
+
+
+def get_rest_bones(armature):
+    '''Returns a bone name to RestBone map for every bone of the armature.
+    Nothing in the scene is created or changed.
+    '''
+    rest_bones = {}
+    for bone in armature.data.bones:
+        rest_bones[bone.name] = RestBone(armature, bone)
+
+    return rest_bones
+
+
+#------------------------------------------------------------------------------
+# Pose Sampling:
+#------------------------------------------------------------------------------
+
+# Pose bone channels read from the action, with their number of components.
+POSE_CHANNELS = (
+    ("location", 3),
+    ("rotation_quaternion", 4),
+    ("rotation_axis_angle", 4),
+    ("rotation_euler", 3),
+    ("scale", 3),
+)
+
+
+def get_unsupported_reason(armature):
+    '''Returns why the pose of the armature can not be evaluated from its
+    action alone, or None when PoseSampler gives the same pose as a scene
+    update.
+    '''
+    if armature.parent is not None:
+        return "armature has a parent"
+
+    for data in (armature, armature.data):
+        animation_data = data.animation_data
+        if animation_data is None:
+            continue
+        if len(animation_data.drivers) > 0:
+            return "{} has drivers".format(data.name)
+        if animation_data.use_nla and len(animation_data.nla_tracks) > 0:
+            return "{} has NLA tracks".format(data.name)
+        if (getattr(animation_data, "action_influence", 1.0) != 1.0 or
+                getattr(animation_data, "action_blend_type",
+                        'REPLACE') != 'REPLACE'):
+            return "{} blends its action".format(data.name)
+        if animation_data.action is None:
+            continue
+        for fcurve in animation_data.action.fcurves:
+            if data is armature.data or not (
+                    fcurve.data_path.startswith("pose.bones[")):
+                return "{} is animated".format(data.name)
+
+    for pose_bone in armature.pose.bones:
+        bone = pose_bone.bone
+        if len(pose_bone.constraints) > 0:
+            return "bone {} has constraints".format(bone.name)
+        if not (bone.use_inherit_rotation and bone.use_inherit_scale and
+                bone.use_local_location):
+            return "bone {} does not inherit all transforms".format(
+                bone.name)
+
+    return None
+
+
+class PoseSampler:
+    '''Evaluates the pose of an armature at any frame straight from the
+    F-curves of its action and the rest pose, so frames do not have to be
+    set one by one. Channels without a curve keep their current value.
+    Check get_unsupported_reason before using it.
+    '''
+
+    def __init__(self, armature):
+        self.__matrix_world = armature.matrix_world.copy()
+        matrix_world_inverted = armature.matrix_world.inverted()
+
+        curves = {}
+        animation_data = armature.animation_data
+        if animation_data is not None and animation_data.action is not None:
+            for fcurve in animation_data.action.fcurves:
+                if not fcurve.mute:
+                    curves[(fcurve.data_path, fcurve.array_index)] = fcurve
+
+        self.__bones = []
+        for bone in self.__get_bones_parents_first(armature):
+            pose_bone = armature.pose.bones[bone.name]
+            if bone.parent is None:
+                offset = bone.matrix_local.copy()
+            else:
+                offset = bone.parent.matrix_local.inverted() * \
+                    bone.matrix_local
+
+            # a fakebone sits at the bone head and follows the deformation
+            fakebone_offset = (bone.matrix_local.inverted() *
+                               matrix_world_inverted *
+                               Matrix.Translation(bone.head_local))
+
+            self.__bones.append(_SampledBone(
+                bone.name,
+                bone.parent.name if bone.parent is not None else None,
+                offset,
+                fakebone_offset,
+                pose_bone.rotation_mode,
+                self.__get_channels(pose_bone, curves)))
+
+    def get_pose_matrices(self, frame):
+        '''Returns a bone name to pose matrix (armature space) map.'''
+        pose_matrices = {}
+        for bone in self.__bones:
+            matrix = bone.offset * bone.get_matrix_basis(frame)
+            if bone.parent_name is not None:
+                matrix = pose_matrices[bone.parent_name] * matrix
+            pose_matrices[bone.name] = matrix
+
+        return pose_matrices
+
+    def get_fakebone_matrices(self, frame):
+        '''Returns a bone name to world matrix map of the fakebones.'''
+        pose_matrices = self.get_pose_matrices(frame)
+        matrices = {}
+        for bone in self.__bones:
+            matrices[bone.name] = (self.__matrix_world *
+                                   pose_matrices[bone.name] *
+                                   bone.fakebone_offset)
+
+        return matrices
+
+    def __get_bones_parents_first(self, armature):
+        bones = []
+        pending = [bone for bone in armature.data.bones
+                   if bone.parent is None]
+        while pending:
+            bone = pending.pop(0)
+            bones.append(bone)
+            pending.extend(bone.children)
+
+        return bones
+
+    def __get_channels(self, pose_bone, curves):
+        name = pose_bone.name.replace("\\", "\\\\").replace('"', '\\"')
+        channels = {}
+        for channel, size in POSE_CHANNELS:
+            data_path = 'pose.bones["{}"].{}'.format(name, channel)
+            values = getattr(pose_bone, channel)
+            channels[channel] = [
+                (curves.get((data_path, index)), values[index])
+                for index in range(size)]
+
+        # Blender ignores the location of connected bones, keyed or not
+        if pose_bone.bone.use_connect and pose_bone.parent is not None:
+            channels["location"] = [(None, 0.0)] * 3
+
+        return channels
+
+
+class _SampledBone:
+
+    def __init__(self, name, parent_name, offset, fakebone_offset,
+                 rotation_mode, channels):
+        self.name = name
+        self.parent_name = parent_name
+        self.offset = offset
+        self.fakebone_offset = fakebone_offset
+        self.rotation_mode = rotation_mode
+        self.channels = channels
+
+    def get_matrix_basis(self, frame):
+        location = self.__evaluate("location", frame)
+        scale = self.__evaluate("scale", frame)
+
+        if self.rotation_mode == 'QUATERNION':
+            rotation = Quaternion(
+                self.__evaluate("rotation_quaternion", frame))
+            rotation.normalize()
+            rotation_matrix = rotation.to_matrix()
+        elif self.rotation_mode == 'AXIS_ANGLE':
+            angle, x, y, z = self.__evaluate("rotation_axis_angle", frame)
+            axis = Vector((x, y, z))
+            if axis.length == 0.0:
+                rotation_matrix = Matrix.Identity(3)
+            else:
+                rotation_matrix = Matrix.Rotation(angle, 3, axis.normalized())
+        else:
+            rotation_matrix = Euler(self.__evaluate("rotation_euler", frame),
+                                    self.rotation_mode).to_matrix()
+
+        matrix = rotation_matrix * Matrix(((scale[0], 0.0, 0.0),
+                                           (0.0, scale[1], 0.0),
+                                           (0.0, 0.0, scale[2])))
+        matrix = matrix.to_4x4()
+        matrix.translation = location
+
+        return matrix
+
+    def __evaluate(self, channel, frame):
+        values = []
+        for fcurve, value in self.channels[channel]:
+            if fcurve is not None:
+                value = fcurve.evaluate(frame)
+            values.append(value)
+
+        return values
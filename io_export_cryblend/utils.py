@@ -17,12 +17,15 @@
 if "bpy" in locals():
     import imp
     imp.reload(exceptions)
+    imp.reload(skeleton)
 else:
     import bpy
-    from io_export_cryblend import exceptions
+    from io_export_cryblend import exceptions, skeleton
 
 
+from io_export_cryblend.daewriter import ArrayText
 from io_export_cryblend.outpipe import cbPrint
+from contextlib import contextmanager
 from mathutils import Matrix, Vector
 from xml.dom.minidom import Document, parseString
 import bpy
@@ -58,6 +61,12 @@ def frame_to_time(frame):
     return fps_base * frame / fps
 
 
+def frames_to_times(frames):
+    fps_base = bpy.context.scene.render.fps_base
+    fps = bpy.context.scene.render.fps
+    return [fps_base * frame / fps for frame in frames]
+
+
 def matrix_to_string(matrix):
     return str(matrix_to_array(matrix))
 
@@ -66,6 +75,10 @@ def floats_to_string(floats, separator=" ", precision="%.6f"):
     return separator.join(precision % x for x in floats)
 
 
+def ints_to_string(ints, separator=" "):
+    return separator.join(map(str, ints))
+
+
 def strings_to_string(strings, separator=" "):
     return separator.join(string for string in strings)
 
@@ -255,6 +268,8 @@ def clean_file():
         node_name = replace_invalid_rc_characters(node_name)
         node.name = "{}.{}".format(node_name, nodetype)
 
+    invalidate_scene_index()
+
 
 def replace_invalid_rc_characters(string):
     # Remove leading and trailing spaces.
@@ -293,14 +308,36 @@ def replace_invalid_rc_characters(string):
 
 
 def fix_weights():
+    '''Normalizes the weights of every skin vertex like the
+    vertex_group_normalize_all operator does: locked groups keep their
+    weights, the unlocked ones share what is left to one. Weightless
+    vertices are left as they are.
+    '''
     for object_ in get_type("skins"):
-        override = get_3d_context(object_)
-        try:
-            bpy.ops.object.vertex_group_normalize_all(
-                override, lock_active=False)
-        except:
-            raise exceptions.CryBlendException(
-                "Please fix weightless vertices first.")
+        if object_.mode == 'EDIT':
+            object_.update_from_editmode()
+
+        locked = [group.lock_weight for group in object_.vertex_groups]
+        for vertex in object_.data.vertices:
+            locked_weight = 0.0
+            unlocked_weight = 0.0
+            for element in vertex.groups:
+                if locked[element.group]:
+                    locked_weight += element.weight
+                else:
+                    unlocked_weight += element.weight
+
+            if unlocked_weight <= 0.0:
+                continue
+            if locked_weight >= 1.0:
+                raise exceptions.CryBlendException(
+                    "Locked vertex groups of {} leave no weight to"
+                    " normalize.".format(object_.name))
+
+            scale = (1.0 - locked_weight) / unlocked_weight
+            for element in vertex.groups:
+                if not locked[element.group]:
+                    element.weight *= scale
     cbPrint("Weights Corrected.")
 
 
@@ -314,15 +351,174 @@ def apply_modifiers():
                     pass
 
 
+#------------------------------------------------------------------------------
+# Operator Check:
+#------------------------------------------------------------------------------
+
+class _ForbiddenOperators:
+    '''Stands in for bpy.ops while operators are forbidden.'''
+
+    def __init__(self, operators):
+        self.operators = operators
+
+    def __getattr__(self, module):
+        return _ForbiddenOperatorModule(module)
+
+
+class _ForbiddenOperatorModule:
+
+    def __init__(self, module):
+        self.__module = module
+
+    def __getattr__(self, operator):
+        raise exceptions.CryBlendException(
+            "bpy.ops.{}.{} was called during the export.".format(
+                self.__module, operator))
+
+
+@contextmanager
+def forbid_operators():
+    '''Any use of an operator inside the block raises a CryBlendException.
+    Used by the "Check Operator Calls" option to keep the export on the
+    data API, operators push undo steps and update the whole scene.
+    '''
+    operators = bpy.ops
+    bpy.ops = _ForbiddenOperators(operators)
+    try:
+        yield
+    finally:
+        bpy.ops = operators
+
+
+@contextmanager
+def allow_operators():
+    '''Lifts forbid_operators inside the block, for the steps which only
+    exist as operators.
+    '''
+    operators = bpy.ops
+    if isinstance(operators, _ForbiddenOperators):
+        bpy.ops = operators.operators
+    try:
+        yield
+    finally:
+        bpy.ops = operators
+
+
+#------------------------------------------------------------------------------
+# Evaluated Meshes:
+#------------------------------------------------------------------------------
+
+__evaluated_meshes = {}
+
+
+def begin_evaluated_meshes(scene):
+    '''Creates temporary meshes of the geometry in the export nodes with all
+    modifiers applied except Armature, which is exported as skin. The scene
+    is not changed, get_mesh returns the temporary meshes until
+    end_evaluated_meshes frees them.
+    '''
+    end_evaluated_meshes()
+
+    for object_ in get_type("geometry"):
+        if all(modifier.type == 'ARMATURE' for modifier in object_.modifiers):
+            continue
+        if object_.mode == 'EDIT':
+            object_.update_from_editmode()
+
+        armature_modifiers = [modifier for modifier in object_.modifiers
+                              if modifier.type == 'ARMATURE' and
+                              modifier.show_viewport]
+        for modifier in armature_modifiers:
+            modifier.show_viewport = False
+        try:
+            mesh = object_.to_mesh(scene, True, 'PREVIEW')
+        finally:
+            for modifier in armature_modifiers:
+                modifier.show_viewport = True
+
+        __evaluated_meshes[object_.as_pointer()] = mesh
+
+
+def end_evaluated_meshes():
+    for mesh in __evaluated_meshes.values():
+        bpy.data.meshes.remove(mesh)
+    __evaluated_meshes.clear()
+
+
+def get_mesh(object_):
+    '''Returns the evaluated mesh of an object during an export with
+    evaluated meshes, otherwise its own mesh.
+    '''
+    return __evaluated_meshes.get(object_.as_pointer(), object_.data)
+
+
 #------------------------------------------------------------------------------
 # Collections:
 #------------------------------------------------------------------------------
 
+class ExportSceneIndex:
+    '''Caches the collections returned by get_type during one export.
+    Collections are gathered on first use and kept in their original order.
+    The index has to be invalidated whenever objects are created, removed
+    or renamed while it is active.
+    '''
+
+    def __init__(self, collect):
+        self.__collect = collect
+        self.invalidate()
+
+    def invalidate(self):
+        self.__collections = {}
+        self.__objects_by_name = None
+
+    def get(self, type_):
+        if type_ not in self.__collections:
+            self.__collections[type_] = self.__collect(type_)
+
+        return self.__collections[type_]
+
+    def get_object(self, name):
+        if self.__objects_by_name is None:
+            self.__objects_by_name = {object_.name: object_
+                                      for object_ in bpy.data.objects}
+
+        return self.__objects_by_name.get(name)
+
+
+__scene_index = None
+
+
+def begin_scene_index():
+    global __scene_index
+    __scene_index = ExportSceneIndex(__collect_type)
+
+
+def end_scene_index():
+    global __scene_index
+    __scene_index = None
+
+
+def invalidate_scene_index():
+    if __scene_index is not None:
+        __scene_index.invalidate()
+
+
+def get_object(name):
+    if __scene_index is not None:
+        return __scene_index.get_object(name)
+
+    return bpy.data.objects.get(name)
+
+
 def get_export_nodes(just_selected=False):
-    export_nodes = []
+    if just_selected:
+        return get_type("selected_nodes")
+
+    return get_type("export_nodes")
 
-    if just_selected:
-        return __get_selected_nodes()
+
+def __get_export_nodes():
+    export_nodes = []
 
     for group in bpy.data.groups:
         if is_export_node(group) and len(group.objects) > 0:
@@ -330,6 +526,7 @@ def get_export_nodes(just_selected=False):
 
     return export_nodes
 
+
 def __get_selected_nodes():
     export_nodes = []
 
@@ -342,7 +539,16 @@ def __get_selected_nodes():
 
 
 def get_type(type_):
+    if __scene_index is not None:
+        return list(__scene_index.get(type_))
+
+    return __collect_type(type_)
+
+
+def __collect_type(type_):
     dispatch = {
+        "export_nodes": __get_export_nodes,
+        "selected_nodes": __get_selected_nodes,
         "objects": __get_objects,
         "geometry": __get_geometry,
         "controllers": __get_controllers,
@@ -354,7 +560,18 @@ def get_type(type_):
         "textures": __get_textures,
         "texture_nodes": __get_texture_nodes_for_cycles
     }
-    return list(set(dispatch[type_]()))
+    return __unique(dispatch[type_]())
+
+
+def __unique(items):
+    unique_items = []
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            unique_items.append(item)
+
+    return unique_items
 
 
 def __get_objects():
@@ -673,9 +890,13 @@ def get_armature_node_name(object_):
 # Fakebones:
 #------------------------------------------------------------------------------
 
+# Bone name to fakebone map, filled by add_fakebones. Armatures which are
+# not animated get skeleton.RestBone entries instead of helper objects.
+__fakebones = {}
+
+
 def get_fakebone(bone_name):
-    return next((fakebone for fakebone in get_type("fakebones")
-                if fakebone.name == bone_name), None)
+    return __fakebones.get(bone_name)
 
 
 def is_fakebone(object_):
@@ -685,53 +906,93 @@ def is_fakebone(object_):
         return False
 
 
-def add_fakebones():
-    '''Add helpers to track bone transforms.'''
+def add_fakebones(animate=True):
+    '''Add helpers to track bone transforms. With animate set the helpers
+    are keyed with the animation of the scene frame range right away.
+    '''
     scene = bpy.context.scene
-    remove_unused_meshes()
+    __fakebones.clear()
     armature = get_armature()
     if armature is None:
         return
 
-    skeleton = armature.data
+    if not is_animated_armature(armature):
+        # static CHR/SKIN exports only need the rest transforms
+        __fakebones.update(skeleton.get_rest_bones(armature))
+        return
+
+    remove_unused_meshes()
+    skeleton_data = armature.data
 
-    skeleton.pose_position = 'REST'
+    skeleton_data.pose_position = 'REST'
     time.sleep(0.5)
 
     deselect_all()
     scene.frame_set(scene.frame_start)
+    mesh = __create_fakebone_mesh()
     for pose_bone in armature.pose.bones:
-        bmatrix = pose_bone.bone.head_local
-        bpy.ops.mesh.primitive_cube_add(radius=.01, location=bmatrix)
-        fakebone = bpy.context.active_object
-        fakebone.name = pose_bone.name
+        fakebone = bpy.data.objects.new(pose_bone.name, mesh)
+        scene.objects.link(fakebone)
+        fakebone.location = pose_bone.bone.head_local
         fakebone["fakebone"] = "fakebone"
-        scene.objects.active = armature
-        armature.data.bones.active = pose_bone.bone
-        bpy.ops.object.parent_set(type='BONE_RELATIVE')
+        __fakebones[pose_bone.name] = fakebone
+        pose_bone.bone.use_relative_parent = True
+        fakebone.parent = armature
+        fakebone.parent_type = 'BONE'
+        fakebone.parent_bone = pose_bone.name
+        # Bone relative parenting as done by the parent_set operator: the
+        # parent is the armature times the channel matrix of the bone, the
+        # parent inverse cancels both and the fakebone keeps its location.
+        fakebone.matrix_parent_inverse = (
+            armature.matrix_world * pose_bone.matrix_channel).inverted()
+    scene.update()
 
+    invalidate_scene_index()
+
+    if animate:
+        process_animation(armature, skeleton_data)
+
+
+def is_animated_armature(armature):
     ALLOWED_NODE_TYPES = ("cga", "anm", "i_caf")
 
     for group in armature.users_group:
-        node_type = get_node_type(group)
+        if get_node_type(group) in ALLOWED_NODE_TYPES:
+            return True
 
-        if node_type in ALLOWED_NODE_TYPES:
-            process_animation(armature, skeleton)
+    return False
 
 
 def remove_fakebones():
     '''Select to remove all fakebones from the scene.'''
+    __fakebones.clear()
     if len(get_type("fakebones")) == 0:
         return
-    old_mode = bpy.context.mode
-    if old_mode != 'OBJECT':
-        bpy.ops.object.mode_set(mode='OBJECT')
-    deselect_all()
+    meshes = set()
     for fakebone in get_type("fakebones"):
-        fakebone.select = True
-        bpy.ops.object.delete(use_global=False)
-    if old_mode != 'OBJECT':
-        bpy.ops.object.mode_set(mode=old_mode)
+        if fakebone.type == 'MESH':
+            meshes.add(fakebone.data)
+        for scene in fakebone.users_scene:
+            scene.objects.unlink(fakebone)
+        bpy.data.objects.remove(fakebone)
+    for mesh in meshes:
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+    invalidate_scene_index()
+
+
+def __create_fakebone_mesh():
+    '''Returns the cube shared by the fakebones.'''
+    RADIUS = 0.01
+    vertices = [(x * RADIUS, y * RADIUS, z * RADIUS)
+                for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1),
+             (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    mesh = bpy.data.meshes.new("fakebone")
+    mesh.from_pydata(vertices, [], faces)
+    mesh.update()
+
+    return mesh
 
 
 #------------------------------------------------------------------------------
@@ -745,80 +1006,276 @@ def process_animation(armature, skeleton):
 
     select_all()
 
+    bake_fakebones(armature)
+
+
+def bake_fakebones(armature):
+    '''Key the fakebones with the bone transforms of the scene frame range,
+    replacing the keys of an earlier bake.
+    '''
     location_list, rotation_list = get_keyframes(armature)
     set_keyframes(armature, location_list, rotation_list)
     cbPrint("Animation was processed.")
 
 
+#------------------------------------------------------------------------------
+# Animation Clips:
+#------------------------------------------------------------------------------
+
+class AnimationClip:
+    '''An action and frame range exported as one i_caf by the batch
+    animation export.
+    '''
+
+    def __init__(self, name, action, frame_start, frame_end):
+        self.name = replace_invalid_rc_characters(name)
+        self.action = action
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+
+
+def get_animation_clips(armature, source, pattern="*"):
+    '''Returns the clips of the armature whose names match the fnmatch
+    pattern. Clips come from all actions animating bones ('ACTIONS'), the
+    ranges between timeline markers ('MARKERS') or the armature NLA strips
+    ('NLA_STRIPS').
+    '''
+    dispatch = {
+        "ACTIONS": __get_action_clips,
+        "MARKERS": __get_marker_clips,
+        "NLA_STRIPS": __get_nla_strip_clips,
+    }
+    clips = []
+    for clip in dispatch[source](armature):
+        if fnmatch.fnmatchcase(clip.name, pattern):
+            clips.append(clip)
+
+    return clips
+
+
+def __get_action_clips(armature):
+    clips = []
+    for action in bpy.data.actions:
+        for fcurve in action.fcurves:
+            if fcurve.data_path.startswith("pose.bones["):
+                frame_start, frame_end = action.frame_range
+                clips.append(AnimationClip(action.name,
+                                           action,
+                                           int(math.floor(frame_start)),
+                                           int(math.ceil(frame_end))))
+                break
+
+    return clips
+
+
+def __get_marker_clips(armature):
+    scene = bpy.context.scene
+    action = None
+    if armature.animation_data is not None:
+        action = armature.animation_data.action
+
+    # every marker starts a clip which ends before the next one
+    markers = sorted(scene.timeline_markers, key=lambda marker: marker.frame)
+    clips = []
+    for index, marker in enumerate(markers):
+        if index + 1 < len(markers):
+            frame_end = markers[index + 1].frame - 1
+        else:
+            frame_end = scene.frame_end
+        if frame_end >= marker.frame:
+            clips.append(AnimationClip(marker.name,
+                                       action,
+                                       marker.frame,
+                                       frame_end))
+
+    return clips
+
+
+def __get_nla_strip_clips(armature):
+    clips = []
+    if armature.animation_data is None:
+        return clips
+
+    for track in armature.animation_data.nla_tracks:
+        for strip in track.strips:
+            if strip.action is not None:
+                clips.append(AnimationClip(
+                    strip.name,
+                    strip.action,
+                    int(math.floor(strip.action_frame_start)),
+                    int(math.ceil(strip.action_frame_end))))
+
+    return clips
+
+
+# Largest difference to the scene allowed for sampled keyframes, in scene
+# units for locations and radians for rotations.
+SAMPLED_KEYFRAME_TOLERANCE = 1e-4
+
+
 def get_keyframes(armature):
     '''Get each bone location and rotation for each frame.'''
+    scene = bpy.context.scene
+    frames = range(scene.frame_start, scene.frame_end + 1)
+
+    reason = skeleton.get_unsupported_reason(armature)
+    if reason is None and len(frames) > 0:
+        sampler = skeleton.PoseSampler(armature)
+        # spot check the sampler against a scene update before trusting it
+        errors = validate_pose_sampler(armature, sampler,
+                                       (frames[0], frames[-1]))
+        if max(errors) <= SAMPLED_KEYFRAME_TOLERANCE:
+            location_list, rotation_list = __get_sampled_keyframes(
+                armature, sampler, frames)
+            cbPrint("Keyframes were sampled from the action.")
+            return location_list, rotation_list
+
+        reason = "sampled pose differs from the scene by {:g}".format(
+            max(errors))
+
+    if reason is not None:
+        cbPrint("Keyframes are read frame by frame, {}.".format(reason))
+
+    location_list, rotation_list = __get_scene_keyframes(armature, frames)
+    cbPrint("Keyframes were appended to lists.")
+
+    return location_list, rotation_list
+
+
+def validate_pose_sampler(armature, sampler, frames):
+    '''Compares keyframes of a skeleton.PoseSampler with the ones read from
+    the fakebones after frame_set. Returns the largest location and rotation
+    differences over the given frames.
+    '''
+    sampled_locations, sampled_rotations = __get_sampled_keyframes(
+        armature, sampler, frames)
+    locations, rotations = __get_scene_keyframes(armature, frames)
+
+    location_error = rotation_error = 0.0
+    for index in range(len(frames)):
+        for bone in armature.pose.bones:
+            location = sampled_locations[index][bone.name]
+            location_error = max(
+                location_error,
+                (location - locations[index][bone.name]).length)
+
+            rotation = sampled_rotations[index][bone.name].to_quaternion()
+            difference = rotation.rotation_difference(
+                rotations[index][bone.name].to_quaternion())
+            # q and -q are the same rotation
+            angle = min(difference.angle, 2.0 * math.pi - difference.angle)
+            rotation_error = max(rotation_error, angle)
+
+    return location_error, rotation_error
+
+
+def __get_sampled_keyframes(armature, sampler, frames):
     location_list = []
     rotation_list = []
 
-    for frame in range(
-            bpy.context.scene.frame_start,
-            bpy.context.scene.frame_end + 1):
-        bpy.context.scene.frame_set(frame)
+    for frame in frames:
+        matrices = sampler.get_fakebone_matrices(frame)
+        locations, rotations = __get_bone_transforms(armature, matrices)
+        location_list.append(locations)
+        rotation_list.append(rotations)
+
+    return location_list, rotation_list
+
+
+def __get_scene_keyframes(armature, frames):
+    location_list = []
+    rotation_list = []
 
-        locations = {}
-        rotations = {}
+    for frame in frames:
+        bpy.context.scene.frame_set(frame)
 
+        matrices = {}
         for bone in armature.pose.bones:
-            fakeBone = bpy.data.objects[bone.name]
+            matrices[bone.name] = get_fakebone(bone.name).matrix_world
 
-            if bone.parent and bone.parent.parent:
-                parentMatrix = bpy.data.objects[
-                    bone.parent.name].matrix_world
+        locations, rotations = __get_bone_transforms(armature, matrices)
+        location_list.append(locations)
+        rotation_list.append(rotations)
 
-                animatrix = parentMatrix.inverted() * fakeBone.matrix_world
-                lm, rm, sm = animatrix.decompose()
-                locations[bone.name] = lm
-                rotations[bone.name] = rm.to_euler()
+    return location_list, rotation_list
 
-            else:
-                lm, rm, sm = fakeBone.matrix_world.decompose()
-                locations[bone.name] = lm
-                rotations[bone.name] = rm.to_euler()
 
-        location_list.append(locations.copy())
-        rotation_list.append(rotations.copy())
+def get_rest_transforms(armature):
+    '''Returns the bone name to location and rotation maps of the rest
+    pose, in the same spaces the fakebone keyframes are baked in.
+    '''
+    matrices = {}
+    for name, rest_bone in skeleton.get_rest_bones(armature).items():
+        matrices[name] = rest_bone.matrix_world
 
-        del locations
-        del rotations
+    return __get_bone_transforms(armature, matrices)
 
-    cbPrint("Keyframes were appended to lists.")
 
-    return location_list, rotation_list
+def __get_bone_transforms(armature, matrices):
+    '''Bones below the root children are written relative to their parent,
+    the others in world space.
+    '''
+    locations = {}
+    rotations = {}
+
+    for bone in armature.pose.bones:
+        matrix = matrices[bone.name]
+
+        if bone.parent and bone.parent.parent:
+            matrix = matrices[bone.parent.name].inverted() * matrix
+
+        lm, rm, sm = matrix.decompose()
+        locations[bone.name] = lm
+        rotations[bone.name] = rm.to_euler()
+
+    return locations, rotations
 
 
 def set_keyframes(armature, location_list, rotation_list):
     '''Insert each keyframe from lists.'''
+    scene = bpy.context.scene
+    frames = range(scene.frame_start, scene.frame_end + 1)
 
-    bpy.context.scene.frame_set(bpy.context.scene.frame_start)
+    for bone in armature.pose.bones:
+        fakebone = get_fakebone(bone.name)
+        locations = [frame_locations[bone.name]
+                     for frame_locations in location_list]
+        rotations = [frame_rotations[bone.name]
+                     for frame_rotations in rotation_list]
 
-    for frame in range(
-            bpy.context.scene.frame_start,
-            bpy.context.scene.frame_end + 1):
-        set_keyframe(armature, frame, location_list, rotation_list)
+        insert_keyframes(fakebone, "location", frames, locations)
+        insert_keyframes(fakebone, "rotation_euler", frames, rotations)
 
-    bpy.context.scene.frame_set(bpy.context.scene.frame_start)
+    scene.frame_set(scene.frame_start)
     cbPrint("Keyframes were inserted to armature fakebones.")
 
 
-def set_keyframe(armature, frame, location_list, rotation_list):
-    '''Inset keyframe for current frame from lists.'''
-    bpy.context.scene.frame_set(frame)
-
-    for bone in armature.pose.bones:
-        index = frame - bpy.context.scene.frame_start
+def insert_keyframes(object_, data_path, frames, values):
+    '''Key every component of an object transform at all frames at once.
+    Curves are filled through their keyframe point arrays, which gives the
+    same keys as keyframe_insert with default preferences: Bezier keys with
+    auto clamped handles in the "Object Transforms" group.
+    '''
+    animation_data = object_.animation_data_create()
+    if animation_data.action is None:
+        animation_data.action = bpy.data.actions.new(
+            "{}Action".format(object_.name))
+    fcurves = animation_data.action.fcurves
 
-        fakeBone = bpy.data.objects[bone.name]
+    for index in range(len(values[0]) if values else 0):
+        for fcurve in list(fcurves):
+            if fcurve.data_path == data_path and fcurve.array_index == index:
+                fcurves.remove(fcurve)
 
-        fakeBone.location = location_list[index][bone.name]
-        fakeBone.rotation_euler = rotation_list[index][bone.name]
+        co = []
+        for frame, value in zip(frames, values):
+            co.append(frame)
+            co.append(value[index])
 
-        fakeBone.keyframe_insert(data_path="location")
-        fakeBone.keyframe_insert(data_path="rotation_euler")
+        fcurve = fcurves.new(data_path, index, "Object Transforms")
+        fcurve.keyframe_points.add(len(values))
+        fcurve.keyframe_points.foreach_set("co", co)
+        fcurve.update()
 
 
 def apply_animation_scale(armature):
@@ -830,44 +1287,21 @@ def apply_animation_scale(armature):
         return
 
     skeleton = armature.data
-    empties = []
+    empties = {}
 
     deselect_all()
     scene.frame_set(scene.frame_start)
     for pose_bone in armature.pose.bones:
-        bmatrix = pose_bone.bone.head_local
-        bpy.ops.object.empty_add(type='PLAIN_AXES', radius=0.1)
-        empty = bpy.context.active_object
-        empty.name = pose_bone.name
-
-        bpy.ops.object.constraint_add(type='CHILD_OF')
-        bpy.data.objects[empty.name].constraints[
-            'Child Of'].use_scale_x = False
-        bpy.data.objects[empty.name].constraints[
-            'Child Of'].use_scale_y = False
-        bpy.data.objects[empty.name].constraints[
-            'Child Of'].use_scale_z = False
-
-        bpy.data.objects[empty.name].constraints['Child Of'].target = armature
-        bpy.data.objects[empty.name].constraints[
-            'Child Of'].subtarget = pose_bone.name
-
-        cbPrint("Baking animation on " + empty.name + "...")
-        bpy.ops.nla.bake(
-            frame_start=scene.frame_start,
-            frame_end=scene.frame_end,
-            step=1,
-            only_selected=True,
-            visual_keying=True,
-            clear_constraints=True,
-            clear_parents=False,
-            bake_types={'OBJECT'})
-
-        empties.append(empty)
-
-    for empty in empties:
-        empty.select = True
+        empty = bpy.data.objects.new(pose_bone.name, None)
+        empty.empty_draw_type = 'PLAIN_AXES'
+        empty.empty_draw_size = 0.1
+        scene.objects.link(empty)
+        empties[pose_bone.name] = empty
+
+    cbPrint("Baking animation on empties...")
+    __bake_bone_transforms(armature, empties)
 
+    invalidate_scene_index()
     cbPrint("Baked Animation successfully on empties.")
     deselect_all()
 
@@ -884,11 +1318,9 @@ def apply_animation_scale(armature):
         pose_bone.constraints.new(type='COPY_LOCATION')
         pose_bone.constraints.new(type='COPY_ROTATION')
 
-        for empty in empties:
-            if empty.name == pose_bone.name:
-                pose_bone.constraints['Copy Location'].target = empty
-                pose_bone.constraints['Copy Rotation'].target = empty
-                break
+        empty = empties[pose_bone.name]
+        pose_bone.constraints['Copy Location'].target = empty
+        pose_bone.constraints['Copy Rotation'].target = empty
 
         pose_bone.bone.select = True
 
@@ -908,23 +1340,54 @@ def apply_animation_scale(armature):
     deselect_all()
 
     cbPrint("Clearing empty data...")
-    for empty in empties:
+    for empty in empties.values():
         empty.select = True
 
     bpy.ops.object.delete()
+    invalidate_scene_index()
 
     cbPrint("Apply Animation was completed.")
 
 
+def __bake_bone_transforms(armature, empties):
+    '''Keys every empty with the world location and rotation of its bone,
+    without the bone scale, for the scene frame range. All bones are read
+    in one pass over the frames and the keys are written in bulk.
+    '''
+    scene = bpy.context.scene
+    frames = range(scene.frame_start, scene.frame_end + 1)
+    locations = {name: [] for name in empties}
+    rotations = {name: [] for name in empties}
+
+    for frame in frames:
+        scene.frame_set(frame)
+        for pose_bone in armature.pose.bones:
+            matrix = armature.matrix_world * pose_bone.matrix
+            location, rotation, scale = matrix.decompose()
+
+            bone_rotations = rotations[pose_bone.name]
+            if bone_rotations:
+                # keep eulers continuous like the visual keying bake
+                euler = rotation.to_euler('XYZ', bone_rotations[-1])
+            else:
+                euler = rotation.to_euler('XYZ')
+
+            locations[pose_bone.name].append(location)
+            bone_rotations.append(euler)
+
+    for name, empty in empties.items():
+        insert_keyframes(empty, "location", frames, locations[name])
+        insert_keyframes(empty, "rotation_euler", frames, rotations[name])
+
+    scene.frame_set(scene.frame_start)
+
+
 #------------------------------------------------------------------------------
 # Bone Geometry:
 #------------------------------------------------------------------------------
 
 def get_bone_geometry(bone_name):
-    try:
-        return bpy.data.objects[bone_name + "_boneGeometry"]
-    except:
-        return None
+    return get_object(bone_name + "_boneGeometry")
 
 
 def is_bone_geometry(object_):
@@ -1010,8 +1473,12 @@ def parent(children, parent):
 
 
 def remove_unused_meshes():
+    '''Removes the meshes without users. The evaluated meshes of a running
+    export have none either, they are kept until end_evaluated_meshes.
+    '''
+    evaluated = {mesh.as_pointer() for mesh in __evaluated_meshes.values()}
     for mesh in bpy.data.meshes:
-        if mesh.users == 0:
+        if mesh.users == 0 and mesh.as_pointer() not in evaluated:
             bpy.data.meshes.remove(mesh)
 
 
@@ -1054,11 +1521,11 @@ def get_3d_context(object_):
 #------------------------------------------------------------------------------
 
 def get_guid():
-    GUID = "{{}-{}-{}-{}-{}}".format(random_hex_sector(8),
-                                     random_hex_sector(4),
-                                     random_hex_sector(4),
-                                     random_hex_sector(4),
-                                     random_hex_sector(12))
+    GUID = "{{{}-{}-{}-{}-{}}}".format(random_hex_sector(8),
+                                       random_hex_sector(4),
+                                       random_hex_sector(4),
+                                       random_hex_sector(4),
+                                       random_hex_sector(12))
     return GUID
 
 
@@ -1136,9 +1603,9 @@ def write_source(id_, type_, array, params):
         source_data = doc.createElement("{!s}_array".format(type_))
     source_data.setAttribute("id", "{!s}-array".format(id_))
     source_data.setAttribute("count", str(length))
-    try:
-        source_data.appendChild(doc.createTextNode(floats_to_string(array)))
-    except TypeError:
+    if type_ in ("float", "float4x4"):
+        source_data.appendChild(ArrayText(array, floats_to_string))
+    else:
         source_data.appendChild(doc.createTextNode(strings_to_string(array)))
     technique_common = doc.createElement("technique_common")
     accessor = doc.createElement("accessor")